@@ -8,10 +8,15 @@
 # ====================================================
 # Load packages
 # ====================================================
+import io
 import os
-import tempfile
-import subprocess
-from typing import Dict, List
+from array import array
+from string import ascii_uppercase
+from typing import Dict, Iterator, List, Optional, TextIO, Tuple, Union
+
+import metrics_func as metrics
+from cache_func import ResultCache, get_cache
+from tool_runner import open_output, run_tool, run_tool_async, scratch_directory
 
 # ===============================================================================
 # ===============================================================================
@@ -24,66 +29,183 @@ class Anarci:
     def __init__(self, sequence: str):
         self._sequence = sequence
 
-    def run_anarci(self) -> List[Dict[str, str]]:
+    def run_anarci(self, use_cache: bool = True) -> List[Dict[str, str]]:
         """Run the ANARCI for searching the V region. 
+        The sequence is given on the command line and the numbering is read from the stdout of ANARCI.
+        The result is looked up in the shared cache first, unless `use_cache=False`.
+        """
+        cache = get_cache(use_cache)
+        if cache is not None:
+            cache_key = ResultCache.make_key("ANARCI", self._sequence, paras="-s k")
+            anarci_result = cache.get(cache_key)
+            if anarci_result is not None:
+                return anarci_result
+        anarci_cmd = f"ANARCI -s k -i {self._sequence}"
+        anarci_run = run_tool("ANARCI", anarci_cmd.split(" "))
+        if anarci_run.returncode == 0:
+            print(f"\n>>> ANARCI processed successfully.")
+        else:
+            raise Exception(f"Error: ANARCI processed failed.")
+        metrics.record_output("ANARCI", anarci_run.stdout)
+        anarci_result = Anarci.get_anarci_result(io.StringIO(anarci_run.stdout))
+        if cache is not None:
+            cache.set(cache_key, anarci_result)
+        return anarci_result
+
+    async def run_anarci_async(self, use_cache: bool = True, timeout: Optional[float] = None) -> List[Dict[str, str]]:
+        """Run the ANARCI without blocking the event loop.
+        The number of ANARCI processes is capped by `tool_runner.set_tool_concurrency("ANARCI", n)`,
+        and the process is killed after `timeout` seconds or when the call is cancelled.
         """
-        with tempfile.NamedTemporaryFile() as input_fasta_file:
-            with open(input_fasta_file.name, 'w') as f:
-                f.write(f">anarci_query_sequence\n{self._sequence}")
-            output_file = f"{input_fasta_file.name}_anarci_result.txt"
-            anarci_cmd = f"ANARCI -s k -i {input_fasta_file.name} -o {output_file}"
-            anarci_run = subprocess.run(anarci_cmd.split(" "), capture_output=True, text=True)
+        cache = get_cache(use_cache)
+        if cache is not None:
+            cache_key = await ResultCache.make_key_async("ANARCI", self._sequence, paras="-s k")
+            anarci_result = await cache.get_async(cache_key)
+            if anarci_result is not None:
+                return anarci_result
+        anarci_cmd = f"ANARCI -s k -i {self._sequence}"
+        anarci_run = await run_tool_async("ANARCI", anarci_cmd.split(" "), timeout)
+        if anarci_run.returncode == 0:
+            print(f"\n>>> ANARCI processed successfully.")
+        else:
+            raise Exception(f"Error: ANARCI processed failed.")
+        metrics.record_output("ANARCI", anarci_run.stdout)
+        anarci_result = Anarci.get_anarci_result(io.StringIO(anarci_run.stdout))
+        if cache is not None:
+            await cache.set_async(cache_key, anarci_result)
+        return anarci_result
+
+    @staticmethod
+    def run_anarci_batch(sequences: Dict[str, str], use_cache: bool = True) -> Dict[str, List[Dict]]:
+        """Number all the sequences (`{sequence_id: sequence}`) with one ANARCI run.
+        The results are returned in the input order, keyed by the sequence id, and the domains are
+        in the compact form of `iter_anarci_result` (see `Anarci.expand_domain`).
+        Repeated or cached sequences are not numbered again. The fasta of the queries is written to
+        the scratch directory (`tool_runner.get_scratch_dir`), and the numbering is read from stdout.
+        """
+        cache = get_cache(use_cache)
+        results = {}
+        cache_keys = {}
+        query_sequences = []
+        for sequence in dict.fromkeys(sequences.values()):
+            if cache is not None:
+                cache_keys[sequence] = ResultCache.make_key("ANARCI", sequence, paras="-s k")
+                cached_result = cache.get(cache_keys[sequence])
+                if cached_result is not None:
+                    results[sequence] = [Anarci.compact_domain(domain) for domain in cached_result]
+                    continue
+            query_sequences.append(sequence)
+        if query_sequences:
+            with scratch_directory() as anarci_tmp_dir:
+                input_fasta_filename = os.path.join(anarci_tmp_dir, "anarci_query.fasta")
+                metrics.add("sequences_total", len(query_sequences), tool="ANARCI")
+                with metrics.stage("ANARCI", "write_input"), open(input_fasta_filename, 'w') as f:
+                    for i, sequence in enumerate(query_sequences):
+                        f.write(f">anarci_query_{i}\n{sequence}\n")
+                anarci_cmd = f"ANARCI -s k -i {input_fasta_filename}"
+                anarci_run = run_tool("ANARCI", anarci_cmd.split(" "))
             if anarci_run.returncode == 0:
-                print(f"\n>>> ANARCI processed successfully.")
+                print(f"\n>>> ANARCI processed {len(query_sequences)} sequences successfully.")
             else:
                 raise Exception(f"Error: ANARCI processed failed.")
-        anarci_result = Anarci.get_anarci_result(output_file)
-        return anarci_result
+            metrics.record_output("ANARCI", anarci_run.stdout)
+            with metrics.stage("ANARCI", "parse"):
+                anarci_records = dict(Anarci.iter_anarci_result(io.StringIO(anarci_run.stdout)))
+            for i, sequence in enumerate(query_sequences):
+                results[sequence] = anarci_records.get(f"anarci_query_{i}", [])
+                if cache is not None:
+                    cache.set(cache_keys[sequence], [Anarci.expand_domain(domain) for domain in results[sequence]])
+        return {seq_id: results[sequence] for seq_id, sequence in sequences.items()}
 
     @staticmethod
-    def get_anarci_result(output_file) -> List[Dict[str, str]]:
+    def get_anarci_result(output_file: Union[str, TextIO]) -> List[Dict[str, str]]:
+        """parse the ANARCI result of a single query, given as an open text stream or by its filename
+        (the file is removed once parsed).
+        """
         anarci_records_list = []
-        with open(output_file, "r") as f:
-            content = f.readlines()
-        if len(content) == 2:
-            pass
-        else:
-            num_v_region = int(content[2].strip().split()[-1])
-            # =======================================================================
-            for i in range (len(content)-1):
-                line = content[i]
-                if line.strip() == '# Most significant HMM hit':
-                    v_kabat_sequence = []
-                    v_kabat_idx = []
-                    v_region_tmp = {}
-                    v_region_infor = content[i+2].strip().split('|')
-                    species = v_region_infor[1]
-                    chain_type = v_region_infor[2]
-                    v_start_idx = int(v_region_infor[5])
-                    v_end_idx = int(v_region_infor[6])+1
-                if line.strip().split()[0] != '#' and\
-                line.strip().split('|')[0] != '#' and\
-                line.strip().split()[0] != '//':
-                    v_kabat_sequence.append(line.strip().split()[-1])
-                    if len(line.strip().split()) == 3:
-                        v_kabat_idx.append(line.strip().split()[1])
-                    if len(line.strip().split()) == 4:
-                        v_kabat_idx.append(line.strip().split()[1] + line.strip().split()[2])
-                if content[i].strip().split()[0] != '#' and\
-                content[i].strip().split('|')[0] != '#' and\
-                (content[i+1].strip().split()[0] == '#' or content[i+1].strip().split()[0] == '//'):
-                    v_region_tmp = {'num_v_region': num_v_region,
-                                    'species' : species,
-                                    'chain_type' : chain_type,
-                                    'v_start_idx': v_start_idx,
-                                    'v_end_idx': v_end_idx,
-                                    'v_kabat_sequence': v_kabat_sequence,
-                                    'v_kabat_idx' : v_kabat_idx}
-                    anarci_records_list.append(v_region_tmp)
-        # ===========================================================================
-        os.system(f"rm {output_file}")
+        if isinstance(output_file, str):
+            metrics.record_bytes("ANARCI", output_file)
+        with metrics.stage("ANARCI", "parse"):
+            for _, domains in Anarci.iter_anarci_result(output_file):
+                anarci_records_list = [Anarci.expand_domain(domain) for domain in domains]
+                break
+        if isinstance(output_file, str):
+            with metrics.stage("ANARCI", "cleanup"):
+                os.remove(output_file)
         return anarci_records_list
 
+    @staticmethod
+    def iter_anarci_result(output_file: Union[str, TextIO]) -> Iterator[Tuple[str, List[Dict]]]:
+        """parse an ANARCI result in one pass and yield `(query_name, domains)` for every query.
+        Each domain keeps its numbering compactly: the residues in the string `v_kabat_sequence`,
+        the kabat positions in the array `v_kabat_position` and the insertion codes in the string
+        `v_kabat_insertion` (`' '` for no insertion).
+        """
+        query_name = None
+        domains = []
+        num_v_region = 0
+        hit_line_countdown = 0
+        domain, residues, insertions = None, [], []
+        with open_output(output_file) as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                if line[0] == '#' or line == '//':
+                    if residues:  # the numbered lines of a domain end at the next comment line
+                        domain['v_kabat_sequence'] = "".join(residues)
+                        domain['v_kabat_insertion'] = "".join(insertions)
+                        domains.append(domain)
+                        domain, residues, insertions = None, [], []
+                    if line == '//':
+                        yield query_name, domains
+                        query_name, domains, num_v_region = None, [], 0
+                    elif query_name is None:
+                        query_name = line[1:].strip()
+                    elif line.startswith('# Domain'):
+                        num_v_region = int(line.split()[-1])
+                    elif line == '# Most significant HMM hit':
+                        hit_line_countdown = 2
+                    elif hit_line_countdown:
+                        hit_line_countdown -= 1
+                        if hit_line_countdown == 0:  # e.g. `#|human|H|1.2e-50|160.0|19|136|`
+                            v_region_infor = line.split('|')
+                            domain = {'num_v_region': num_v_region,
+                                      'species': v_region_infor[1],
+                                      'chain_type': v_region_infor[2],
+                                      'v_start_idx': int(v_region_infor[5]),
+                                      'v_end_idx': int(v_region_infor[6]) + 1,
+                                      'v_kabat_position': array('H')}
+                    continue
+                # a numbered line, e.g. `H 82 A    S`
+                numbered = line.split()
+                residues.append(numbered[-1])
+                domain['v_kabat_position'].append(int(numbered[1]))
+                insertions.append(numbered[2] if len(numbered) == 4 else ' ')
+
+    @staticmethod
+    def expand_domain(domain: Dict) -> Dict:
+        """Convert a compact domain to the form of `run_anarci`, with the lists `v_kabat_sequence` and `v_kabat_idx`.
+        """
+        v_region = {key: value for key, value in domain.items()
+                    if key not in ('v_kabat_sequence', 'v_kabat_position', 'v_kabat_insertion')}
+        v_region['v_kabat_sequence'] = list(domain['v_kabat_sequence'])
+        v_region['v_kabat_idx'] = [
+            f"{position}{insertion}" if insertion != ' ' else str(position)
+            for position, insertion in zip(domain['v_kabat_position'], domain['v_kabat_insertion'])
+        ]
+        return v_region
+
+    @staticmethod
+    def compact_domain(v_region: Dict) -> Dict:
+        """Convert a domain of `run_anarci` to the compact form of `iter_anarci_result`.
+        """
+        domain = {key: value for key, value in v_region.items() if key not in ('v_kabat_sequence', 'v_kabat_idx')}
+        domain['v_kabat_sequence'] = "".join(v_region['v_kabat_sequence'])
+        domain['v_kabat_position'] = array('H', (int(idx.rstrip(ascii_uppercase)) for idx in v_region['v_kabat_idx']))
+        domain['v_kabat_insertion'] = "".join(idx[-1] if idx[-1].isalpha() else ' ' for idx in v_region['v_kabat_idx'])
+        return domain
+
 # test
 if __name__ == "__main__":
     a = Anarci(
@@ -0,0 +1,122 @@
+# -*- coding: utf-8 -*-
+#===============================================================================
+# Data      : 20261017
+# Author    : Xuanming
+# Annotation: This script is used to annotate many sequences with signalp, ANARCI, blast and the physicochemical properties in parallel.
+#===============================================================================
+
+# ====================================================
+# Load packages
+# ====================================================
+import os
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Any, Dict, Iterator, Optional, Sequence
+
+from anarci_func import Anarci
+from blast_func import (BLASTP_DATABASE_PATH, BLASTP_PARAS, TBLASTN_DATABASE_PATH, TBLASTN_PARAS,
+                        Blast, Blastp, TBlastn)
+from calculate_physicochem import PhysicoChem
+from signalp_func import Signalp
+
+ANNOTATION_STEPS = ("signalp", "anarci", "blastp", "tblastn", "physicochem")
+#===============================================================================
+#===============================================================================
+def _run_signalp(chunk: Dict[str, str], blast_threads: int) -> Dict[str, Dict[str, Any]]:
+    signalp_results = Signalp.run_signalp_batch(chunk)
+    return {seq_id: {'signalp': signalp_result} for seq_id, signalp_result in signalp_results.items()}
+
+
+def _run_anarci(chunk: Dict[str, str], blast_threads: int) -> Dict[str, Dict[str, Any]]:
+    anarci_results = Anarci.run_anarci_batch(chunk)
+    return {seq_id: {'v_regions': anarci_result} for seq_id, anarci_result in anarci_results.items()}
+
+
+def _run_blastp(chunk: Dict[str, str], blast_threads: int) -> Dict[str, Dict[str, Any]]:
+    blastp_results = Blastp.run_blast_batch(
+        chunk, BLASTP_DATABASE_PATH, Blast.set_num_threads(BLASTP_PARAS, blast_threads)
+    )
+    return {seq_id: {'c_region_blast': blastp_result} for seq_id, blastp_result in blastp_results.items()}
+
+
+def _run_tblastn(chunk: Dict[str, str], blast_threads: int) -> Dict[str, Dict[str, Any]]:
+    tblastn_results = TBlastn.run_blast_batch(
+        chunk, TBLASTN_DATABASE_PATH, Blast.set_num_threads(TBLASTN_PARAS, blast_threads)
+    )
+    return {seq_id: {'v_region_blast': tblastn_result} for seq_id, tblastn_result in tblastn_results.items()}
+
+
+def _run_physicochem(chunk: Dict[str, str], blast_threads: int) -> Dict[str, Dict[str, Any]]:
+    physicochem_columns = PhysicoChem.bulk(list(chunk.values()))
+    return {
+        seq_id: {name: float(column[i]) for name, column in physicochem_columns.items()}
+        for i, seq_id in enumerate(chunk)
+    }
+
+
+_STEP_FUNCTIONS = {
+    'signalp': _run_signalp,
+    'anarci': _run_anarci,
+    'blastp': _run_blastp,
+    'tblastn': _run_tblastn,
+    'physicochem': _run_physicochem,
+}
+
+
+def _iter_chunks(sequences: Dict[str, str], chunk_size: int) -> Iterator[Dict[str, str]]:
+    chunk = {}
+    for seq_id, sequence in sequences.items():
+        chunk[seq_id] = sequence
+        if len(chunk) == chunk_size:
+            yield chunk
+            chunk = {}
+    if chunk:
+        yield chunk
+
+
+def annotate(
+        sequences: Dict[str, str],
+        workers: int = 4,
+        chunk_size: int = 64,
+        steps: Sequence[str] = ANNOTATION_STEPS,
+        max_pending: Optional[int] = None
+) -> Dict[str, Dict[str, Any]]:
+    """Annotate the sequences (`{sequence_id: sequence}`) and return one merged record per sequence,
+    in the input order. The `v_regions` are the compact domains of `Anarci.run_anarci_batch`.
+    The sequences are cut into chunks of `chunk_size`, and every (chunk, step) pair is a job of a thread pool
+    with `workers` threads; at most `max_pending` (default `2 * workers`) jobs are queued at once.
+    The blast jobs share the cores, so each one runs with `cpu_count // workers` threads.
+    """
+    unknown_steps = set(steps) - set(_STEP_FUNCTIONS)
+    if unknown_steps:
+        raise ValueError(f"Error: unknown annotation steps {sorted(unknown_steps)}.")
+    max_pending = max_pending or 2 * workers
+    blast_threads = max(1, (os.cpu_count() or 1) // workers)
+    records = {seq_id: {'sequence_id': seq_id, 'sequence': sequence} for seq_id, sequence in sequences.items()}
+    jobs = ((step, chunk) for chunk in _iter_chunks(sequences, chunk_size) for step in steps)
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        pending = set()
+        for step, chunk in jobs:
+            if len(pending) >= max_pending:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                _merge_records(records, done)
+            pending.add(executor.submit(_STEP_FUNCTIONS[step], chunk, blast_threads))
+        done, _ = wait(pending)
+        _merge_records(records, done)
+    return records
+
+
+def _merge_records(records: Dict[str, Dict[str, Any]], done) -> None:
+    for future in done:
+        for seq_id, step_record in future.result().items():
+            records[seq_id].update(step_record)
+
+
+if __name__ == '__main__':
+    annotate_records = annotate(
+        {
+            'heavy_chain': "MGWTLVFLFLLSVTAGVHSQEQLEESGGDLVKPGASLTLTCTASGFSFSSSYWICWVRQAPGKGLEWIACIYAGGIGSTYYASWAKGRFTISKTSSTTVTLQMTSLTAADTATYFCAGDLPGGGYYTLTRLDLWGQGTLVTVSSASTKGPSVFPLAPSSKSTSGGTAALGCLVKDYFPEPVTVSWNSGALTSGVHTFPAVLQSSGLYSLSSVVTVPSSSLGTQTYICNVNHKPSNTKVDKKVEPKSCDKTHTCPPCPAPELLGGPSVFLFPPKPKDTLMISRTPEVTCVVVDVSHEDPEVKFNWYVDGVEVHNAKTKPREEQYNSTYRVVSVLTVLHQDWLNGKEYKCKVSNKALPAPIEKTISKAKGQPREPQVYTLPPSREEMTKNQVSLTCLVKGFYPSDIAVEWESNGQPENNYKTTPPVLDSDGSFFLYSKLTVDKSRWQQGNVFSCSVMHEALHNHYTQKSLSLSPGK",
+            'scfv': "DVQLVQSGAEVKKPGASVKVSCKASGYTFTRYTMHWVRQAPGQGLEWIGYINPSRGYTNYADSVKGRFTITTDKSTSTAYMELSSLRSEDTATYYCARYYDDHYCLDYWGQGTTVTVSSGGGGSDIVLTQSPATLSLSPGERATLSCRASQSVSYMNWYQQKPGKAPKRWIYDTSKVASGVPARFSGSGSGTDYSLTINSLEAEDAATYYCQQWSSNPLTFGGGTKVEIKGGGGSRTVAAPSVFIFPPSDEQLKSGTASVVCLLNNFYPREAKVQWKVDNALQSGNSQESVTEQDSKDSTYSLSSTLTLSKADYEKHKVYACEVTHQGLSSPVTKSFNRGEC",
+        },
+        workers=2,
+    )
+    print(annotate_records)
@@ -0,0 +1,212 @@
+# -*- coding: utf-8 -*-
+#===============================================================================
+# Data      : 20261017
+# Author    : Xuanming
+# Annotation: This script is used to write the canned outputs of the fake blastp, tblastn, ANARCI and signalp.
+#===============================================================================
+
+# ====================================================
+# Load packages
+# ====================================================
+import os
+import sys
+import zlib
+from contextlib import contextmanager
+from typing import List, Optional, Tuple
+
+#===============================================================================
+#===============================================================================
+FAKE_VERSION = "fake 0.0.1"
+
+
+def read_fasta(fasta_filename: str) -> List[Tuple[str, str]]:
+    """Read a fasta file, or the stdin when `fasta_filename` is `-`.
+    """
+    records = []
+    with (open(fasta_filename) if fasta_filename != "-" else sys.stdin) as f:
+        for line in f:
+            line = line.strip()
+            if line.startswith(">"):
+                records.append([line[1:].split()[0], []])
+            elif line:
+                records[-1][1].append(line)
+    return [(name, "".join(sequence)) for name, sequence in records]
+
+
+@contextmanager
+def open_output(filename: Optional[str]):
+    """Open the output file, or pass the stdout through when `filename` is `None` or `-`.
+    """
+    if filename is None or filename == "-":
+        yield sys.stdout
+    else:
+        with open(filename, "w") as out:
+            yield out
+
+
+def get_argument(argv: List[str], flag: str, default=None):
+    return argv[argv.index(flag) + 1] if flag in argv else default
+
+
+def _seed(sequence: str) -> int:
+    return zlib.crc32(sequence.encode())
+
+
+def _hsps(sequence: str) -> List[dict]:
+    """Three hits on the references `seed % 7 ...`, the first 100 residues aligned with a mismatch every
+    `10 + hit_num` residues; a sequence whose seed is a multiple of 5 has no hit.
+    """
+    seed = _seed(sequence)
+    if seed % 5 == 0 or not sequence:
+        return []
+    hsps = []
+    align_length = min(len(sequence), 100)
+    query = sequence[:align_length]
+    for hit_num in range(3):
+        step = 10 + hit_num
+        sbjct = "".join("W" if i % step == step - 1 and q != "W" else q for i, q in enumerate(query))
+        identities = sum(q == h for q, h in zip(query, sbjct))
+        score = 5 * identities - 2 * (align_length - identities)
+        hsps.append({'ref': (seed + hit_num) % 7,
+                     'score': score,
+                     'bits': round(score * 0.4, 1),
+                     'evalue': f"{10.0 ** -(score // 20):.2e}",
+                     'identities': identities,
+                     'align_length': align_length,
+                     'query': query,
+                     'sbjct': sbjct,
+                     'match': "".join(q if q == h else " " for q, h in zip(query, sbjct))})
+    return hsps
+
+
+def write_blast_xml(program: str, queries: List[Tuple[str, str]], out):
+    hit_frame = 1 if program == "tblastn" else 0
+    out.write('<?xml version="1.0"?>\n'
+              '<!DOCTYPE BlastOutput PUBLIC "-//NCBI//NCBI BlastOutput/EN" "http://www.ncbi.nlm.nih.gov/dtd/NCBI_BlastOutput.dtd">\n'
+              f'<BlastOutput>\n  <BlastOutput_program>{program}</BlastOutput_program>\n'
+              f'  <BlastOutput_version>{program.upper()} 2.12.0+</BlastOutput_version>\n'
+              '  <BlastOutput_reference>fake</BlastOutput_reference>\n  <BlastOutput_db>fake</BlastOutput_db>\n'
+              f'  <BlastOutput_query-ID>Query_1</BlastOutput_query-ID>\n  <BlastOutput_query-def>{queries[0][0] if queries else ""}</BlastOutput_query-def>\n'
+              f'  <BlastOutput_query-len>{len(queries[0][1]) if queries else 0}</BlastOutput_query-len>\n'
+              '  <BlastOutput_param>\n    <Parameters>\n      <Parameters_matrix>PAM30</Parameters_matrix>\n'
+              '      <Parameters_expect>10</Parameters_expect>\n      <Parameters_gap-open>9</Parameters_gap-open>\n'
+              '      <Parameters_gap-extend>1</Parameters_gap-extend>\n      <Parameters_filter>F</Parameters_filter>\n'
+              '    </Parameters>\n  </BlastOutput_param>\n<BlastOutput_iterations>\n')
+    for iter_num, (name, sequence) in enumerate(queries, 1):
+        out.write(f'<Iteration>\n  <Iteration_iter-num>{iter_num}</Iteration_iter-num>\n'
+                  f'  <Iteration_query-ID>Query_{iter_num}</Iteration_query-ID>\n'
+                  f'  <Iteration_query-def>{name}</Iteration_query-def>\n'
+                  f'  <Iteration_query-len>{len(sequence)}</Iteration_query-len>\n<Iteration_hits>\n')
+        hsps = _hsps(sequence)
+        for hit_num, hsp in enumerate(hsps, 1):
+            out.write(f'<Hit>\n  <Hit_num>{hit_num}</Hit_num>\n  <Hit_id>gnl|BL_ORD_ID|{hsp["ref"]}</Hit_id>\n'
+                      f'  <Hit_def>fake_reference_{hsp["ref"]}</Hit_def>\n  <Hit_accession>{hsp["ref"]}</Hit_accession>\n'
+                      f'  <Hit_len>{hsp["align_length"] + 10}</Hit_len>\n  <Hit_hsps>\n    <Hsp>\n'
+                      f'      <Hsp_num>1</Hsp_num>\n      <Hsp_bit-score>{hsp["bits"]}</Hsp_bit-score>\n'
+                      f'      <Hsp_score>{hsp["score"]}</Hsp_score>\n      <Hsp_evalue>{hsp["evalue"]}</Hsp_evalue>\n'
+                      f'      <Hsp_query-from>1</Hsp_query-from>\n      <Hsp_query-to>{hsp["align_length"]}</Hsp_query-to>\n'
+                      f'      <Hsp_hit-from>1</Hsp_hit-from>\n      <Hsp_hit-to>{hsp["align_length"]}</Hsp_hit-to>\n'
+                      f'      <Hsp_query-frame>0</Hsp_query-frame>\n      <Hsp_hit-frame>{hit_frame}</Hsp_hit-frame>\n'
+                      f'      <Hsp_identity>{hsp["identities"]}</Hsp_identity>\n      <Hsp_positive>{hsp["identities"]}</Hsp_positive>\n'
+                      f'      <Hsp_gaps>0</Hsp_gaps>\n      <Hsp_align-len>{hsp["align_length"]}</Hsp_align-len>\n'
+                      f'      <Hsp_qseq>{hsp["query"]}</Hsp_qseq>\n      <Hsp_hseq>{hsp["sbjct"]}</Hsp_hseq>\n'
+                      f'      <Hsp_midline>{hsp["match"]}</Hsp_midline>\n    </Hsp>\n  </Hit_hsps>\n</Hit>\n')
+        out.write('</Iteration_hits>\n  <Iteration_stat>\n    <Statistics>\n'
+                  '      <Statistics_db-num>7</Statistics_db-num>\n      <Statistics_db-len>770</Statistics_db-len>\n'
+                  '      <Statistics_hsp-len>0</Statistics_hsp-len>\n      <Statistics_eff-space>0</Statistics_eff-space>\n'
+                  '      <Statistics_kappa>0.041</Statistics_kappa>\n      <Statistics_lambda>0.267</Statistics_lambda>\n'
+                  '      <Statistics_entropy>0.14</Statistics_entropy>\n    </Statistics>\n  </Iteration_stat>\n')
+        if not hsps:
+            out.write('  <Iteration_message>No hits found</Iteration_message>\n')
+        out.write('</Iteration>\n')
+    out.write('</BlastOutput_iterations>\n</BlastOutput>\n\n')
+
+
+def write_blast_tabular(program: str, queries: List[Tuple[str, str]], outfmt: str, out):
+    hit_frame = 1 if program == "tblastn" else 0
+    fields = outfmt.split()[1:]
+    for name, sequence in queries:
+        for hsp in _hsps(sequence):
+            row = {'qseqid': name, 'sseqid': f"gnl|BL_ORD_ID|{hsp['ref']}", 'stitle': f"fake_reference_{hsp['ref']}",
+                   'sacc': hsp['ref'], 'slen': hsp['align_length'] + 10, 'bitscore': hsp['bits'],
+                   'evalue': hsp['evalue'], 'score': hsp['score'], 'length': hsp['align_length'],
+                   'nident': hsp['identities'], 'positive': hsp['identities'], 'gaps': 0,
+                   'qframe': 0, 'sframe': hit_frame, 'qstart': 1, 'qend': hsp['align_length'],
+                   'sstart': 1, 'send': hsp['align_length'], 'qseq': hsp['query'], 'sseq': hsp['sbjct']}
+            out.write("\t".join(str(row[field]) for field in fields) + "\n")
+
+
+def write_anarci(queries: List[Tuple[str, str]], out):
+    """Number the first 110 residues as a heavy chain (with the insertions 82A-82C) for the sequences
+    longer than 100, and the residues 120-229 as a kappa chain for those longer than 230.
+    """
+    for name, sequence in queries:
+        out.write(f"# {name}\n")
+        domains = [(chain, start) for chain, start, min_length in (("H", 0, 100), ("K", 120, 230))
+                   if len(sequence) > min_length]
+        if domains:
+            out.write("# ANARCI numbered\n")
+        for domain_num, (chain, start) in enumerate(domains, 1):
+            out.write(f"# Domain {domain_num} of {len(domains)}\n# Most significant HMM hit\n"
+                      "#|species|chain_type|e-value|score|seqstart_index|seqend_index|\n"
+                      f"#|human|{chain}|1.3e-52|168.8|{start}|{start + 109}|\n"
+                      "# Most sequence-identical germlines\n#|species|v_gene|v_identity|j_gene|j_identity|\n"
+                      "#|human|IGHV3-23*01|0.85|IGHJ4*01|0.86|\n# Scheme = kabat\n")
+            numbering = [(position, " ") for position in range(1, 111)]
+            if chain == "H":
+                numbering = numbering[:82] + [(82, insertion) for insertion in "ABC"] + numbering[82:107]
+            for (position, insertion), residue in zip(numbering, sequence[start:start + 110]):
+                out.write(f"{chain} {position:<5} {insertion} {residue}\n")
+        out.write("//\n")
+
+
+def write_signalp(queries: List[Tuple[str, str]], out):
+    out.write("# SignalP-5.0\tOrganism: Eukarya\tTimestamp: 20261017000000\n"
+              "# ID\tPrediction\tSP(Sec/SPI)\tOTHER\tCS Position\n")
+    for name, sequence in queries:
+        if _seed(sequence) % 2:
+            out.write(f"{name}\tSP(Sec/SPI)\t0.998\t0.002\tCS pos: 19-20. VHS-QE. Pr: 0.9735\n")
+        else:
+            out.write(f"{name}\tOTHER\t0.001\t0.999\t\n")
+
+
+def main_blast(program: str):
+    argv = sys.argv[1:]
+    if "-version" in argv:
+        print(f"{program}: {FAKE_VERSION}")
+        return
+    queries = read_fasta(get_argument(argv, "-query", "-"))
+    outfmt = get_argument(argv, "-outfmt", "5")
+    with open_output(get_argument(argv, "-out")) as out:
+        if outfmt.startswith("6"):
+            write_blast_tabular(program, queries, outfmt, out)
+        else:
+            write_blast_xml(program, queries, out)
+
+
+def main_anarci():
+    argv = sys.argv[1:]
+    if "-version" in argv or "--version" in argv:
+        print(f"ANARCI: {FAKE_VERSION}")
+        return
+    anarci_input = get_argument(argv, "-i")
+    if os.path.isfile(anarci_input):
+        queries = read_fasta(anarci_input)
+    else:  # a sequence given on the command line
+        queries = [("Input sequence", anarci_input)]
+    with open_output(get_argument(argv, "-o")) as out:
+        write_anarci(queries, out)
+
+
+def main_signalp():
+    """signalp5 writes `{prefix}_summary.signalp5`, with the prefix defaulting to the fasta file name in the working directory,
+    or prints the summary with `-stdout`.
+    """
+    argv = sys.argv[1:]
+    if "-version" in argv:
+        print(f"signalp: {FAKE_VERSION}")
+        return
+    fasta_filename = get_argument(argv, "-fasta")
+    prefix = get_argument(argv, "-prefix", fasta_filename.split("/")[-1])
+    with open_output(None if "-stdout" in argv else f"{prefix}_summary.signalp5") as out:
+        write_signalp(read_fasta(fasta_filename), out)
@@ -0,0 +1,249 @@
+# -*- coding: utf-8 -*-
+#===============================================================================
+# Data      : 20261017
+# Author    : Xuanming
+# Annotation: This script is used to benchmark the parsers, the tool wrappers and PhysicoChem with the fake tools.
+#===============================================================================
+
+# ====================================================
+# Load packages
+# ====================================================
+import os
+import io
+import sys
+import json
+import time
+import random
+import shutil
+import platform
+import argparse
+import tempfile
+import statistics
+import subprocess
+from contextlib import redirect_stdout
+from typing import Callable, Dict, List, Optional
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+FAKE_TOOLS_DIR = os.path.join(BENCHMARK_DIR, "fake_tools")
+sys.path.insert(0, os.path.dirname(BENCHMARK_DIR))
+sys.path.insert(0, FAKE_TOOLS_DIR)
+# The fake tools come first on PATH, and the shared result cache is off, so every call runs the tool.
+os.environ["PATH"] = FAKE_TOOLS_DIR + os.pathsep + os.environ.get("PATH", "")
+os.environ["UTILS_GEN_CACHE"] = "0"
+
+from _canned import write_anarci, write_blast_tabular, write_blast_xml, write_signalp
+from anarci_func import Anarci
+from blast_func import BLAST_TABULAR_OUTFMT, Blast, Blastp, TBlastn
+from calculate_physicochem import PhysicoChem
+from signalp_func import Signalp
+
+AMINO_ACIDS = "ACDEFGHIKLMNPQRSTVWY"
+DEFAULT_SCALES = (1, 10, 100, 1000, 10000, 100000)
+FAKE_DATABASE_PATH = "fake_database"
+#===============================================================================
+#===============================================================================
+def make_sequences(number: int, seed: int = 0) -> List[str]:
+    """Random proteins of 90-460 residues, so the fake ANARCI numbers zero, one or two domains.
+    """
+    rng = random.Random(seed)
+    return ["".join(rng.choices(AMINO_ACIDS, k=rng.randint(90, 460))) for _ in range(number)]
+
+
+def measure(
+        stage: str,
+        number: int,
+        func: Callable[[], object],
+        repeat: int,
+        setup: Optional[Callable[[], object]] = None
+) -> Dict:
+    """Time `func` `repeat` times (`setup` runs untimed before every call) and summarize the wall times.
+    """
+    timings = []
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        with redirect_stdout(io.StringIO()):  # the wrappers print a line per tool run
+            start = time.perf_counter()
+            func()
+            timings.append(time.perf_counter() - start)
+    median = statistics.median(timings)
+    result = {'stage': stage,
+              'sequences': number,
+              'repeat': repeat,
+              'min_s': min(timings),
+              'median_s': median,
+              'mean_s': statistics.fmean(timings),
+              'per_sequence_us': median / number * 1e6,
+              'sequences_per_s': number / median if median else float("inf")}
+    print(f"{stage:<42} n={number:<7} median={median * 1e3:10.3f} ms  {result['per_sequence_us']:10.2f} us/seq", file=sys.stderr)
+    return result
+
+
+def _write(path: str, writer: Callable, *args):
+    with open(path, "w") as out:
+        writer(*args, out)
+
+
+def bench_parsers(sequences: List[str], work_dir: str, repeat: int) -> List[Dict]:
+    """The parsers on canned outputs of `len(sequences)` queries. The single-query parsers remove
+    their input, so it is copied back (untimed) before every call.
+    """
+    number = len(sequences)
+    queries = [(f"query_{i}", sequence) for i, sequence in enumerate(sequences)]
+    blast_xml = os.path.join(work_dir, "blast.xml")
+    blast_tsv = os.path.join(work_dir, "blast.tsv")
+    anarci_txt = os.path.join(work_dir, "anarci.txt")
+    signalp_txt = os.path.join(work_dir, "signalp_summary.signalp5")
+    _write(blast_xml, write_blast_xml, "blastp", queries)
+    _write(blast_tsv, write_blast_tabular, "blastp", queries, BLAST_TABULAR_OUTFMT)
+    _write(anarci_txt, write_anarci, queries)
+    _write(signalp_txt, write_signalp, queries)
+    results = []
+    if number == 1:
+        anarci_copy = os.path.join(work_dir, "anarci_copy.txt")
+        signalp_copy = os.path.join(work_dir, "signalp_copy_summary.signalp5")
+        results += [
+            measure("parse.blast.get_blast_result", 1, lambda: Blast.get_blast_result(blast_xml), repeat),
+            measure("parse.anarci.get_anarci_result", 1, lambda: Anarci.get_anarci_result(anarci_copy), repeat,
+                    setup=lambda: shutil.copyfile(anarci_txt, anarci_copy)),
+            measure("parse.signalp.get_signalp_result", 1, lambda: Signalp.get_signalp_result(signalp_copy), repeat,
+                    setup=lambda: shutil.copyfile(signalp_txt, signalp_copy)),
+        ]
+    results += [
+        measure("parse.blast.get_blast_results", number, lambda: Blast.get_blast_results(blast_xml), repeat),
+        measure("parse.blast.get_blast_results.lean", number,
+                lambda: Blast.get_blast_results(blast_xml, lean=True), repeat),
+        measure("parse.blast.get_blast_tabular_results", number,
+                lambda: Blast.get_blast_tabular_results(blast_tsv), repeat),
+        measure("parse.anarci.iter_anarci_result", number,
+                lambda: list(Anarci.iter_anarci_result(anarci_txt)), repeat),
+        measure("parse.signalp.get_signalp_results", number,
+                lambda: Signalp.get_signalp_results(signalp_txt), repeat),
+    ]
+    return results
+
+
+def bench_subprocess(sequences: List[str], repeat: int) -> List[Dict]:
+    """The wrappers end to end with the fake tools: one process per sequence for `run_*`
+    (only at the smallest scales), and one process for the whole batch for `run_*_batch`.
+    `subprocess.spawn` is the bare cost of starting a fake tool, i.e. the floor of every call.
+    """
+    number = len(sequences)
+    batch = {f"sequence_{i}": sequence for i, sequence in enumerate(sequences)}
+    results = []
+    if number == 1:
+        results.append(measure("subprocess.spawn", 1, lambda: subprocess.run(
+            ["blastp", "-version"], capture_output=True, text=True), repeat))
+    if number <= 10:
+        results += [
+            measure("subprocess.blastp.run_blast", number, lambda: [
+                Blastp(sequence).run_blast(FAKE_DATABASE_PATH, use_cache=False) for sequence in sequences], repeat),
+            measure("subprocess.tblastn.run_blast", number, lambda: [
+                TBlastn(sequence).run_blast(FAKE_DATABASE_PATH, use_cache=False) for sequence in sequences], repeat),
+            measure("subprocess.anarci.run_anarci", number, lambda: [
+                Anarci(sequence).run_anarci(use_cache=False) for sequence in sequences], repeat),
+            measure("subprocess.signalp.run_signalp", number, lambda: [
+                Signalp(sequence).run_signalp(use_cache=False) for sequence in sequences], repeat),
+        ]
+    results += [
+        measure("subprocess.blastp.run_blast_batch", number, lambda: Blastp.run_blast_batch(
+            batch, FAKE_DATABASE_PATH, "-outfmt 5", use_cache=False), repeat),
+        measure("subprocess.blastp.run_blast_batch.tabular", number, lambda: Blastp.run_blast_batch(
+            batch, FAKE_DATABASE_PATH, "-outfmt 5", tabular=True, use_cache=False), repeat),
+        measure("subprocess.tblastn.run_blast_batch", number, lambda: TBlastn.run_blast_batch(
+            batch, FAKE_DATABASE_PATH, "-outfmt 5", use_cache=False), repeat),
+        measure("subprocess.anarci.run_anarci_batch", number, lambda: Anarci.run_anarci_batch(
+            batch, use_cache=False), repeat),
+        measure("subprocess.signalp.run_signalp_batch", number, lambda: Signalp.run_signalp_batch(
+            batch, use_cache=False), repeat),
+    ]
+    return results
+
+
+def bench_physicochem(sequences: List[str], repeat: int, scalar_limit: int) -> List[Dict]:
+    number = len(sequences)
+    results = []
+    if number <= scalar_limit:
+        def scalar():
+            for sequence in sequences:
+                molecular_weight = PhysicoChem.cal_molecular_weight(sequence)
+                PhysicoChem.cal_isoelectric_point(sequence)
+                PhysicoChem.cal_extinction_coefficient(sequence, molecular_weight)
+        results.append(measure("physicochem.scalar", number, scalar, repeat))
+    results.append(measure("physicochem.bulk", number, lambda: PhysicoChem.bulk(sequences), repeat))
+    return results
+
+
+def compare(results: List[Dict], baseline_filename: str, tolerance: float) -> List[str]:
+    """Return the stages whose median time grew by more than `tolerance` over the baseline.
+    """
+    with open(baseline_filename) as f:
+        baseline = {(result['stage'], result['sequences']): result for result in json.load(f)['results']}
+    regressions = []
+    for result in results:
+        baseline_result = baseline.get((result['stage'], result['sequences']))
+        if baseline_result is not None and result['median_s'] > baseline_result['median_s'] * (1 + tolerance):
+            regressions.append(f"{result['stage']} n={result['sequences']}: "
+                               f"{baseline_result['median_s']:.6f} s -> {result['median_s']:.6f} s")
+    return regressions
+
+
+def run_benchmarks(
+        scales=DEFAULT_SCALES,
+        repeat: int = 3,
+        stages=("parse", "subprocess", "physicochem"),
+        max_subprocess_scale: int = 10000,
+        scalar_limit: int = 10000
+) -> Dict:
+    """Run the benchmarks at every scale and return `{'meta': ..., 'results': [...]}`.
+    The canned outputs of the parsers are written to a temporary directory.
+    """
+    results = []
+    with tempfile.TemporaryDirectory() as work_dir:
+        for number in scales:
+            sequences = make_sequences(number)
+            if "parse" in stages:
+                results += bench_parsers(sequences, work_dir, repeat)
+            if "subprocess" in stages and number <= max_subprocess_scale:
+                results += bench_subprocess(sequences, repeat)
+            if "physicochem" in stages:
+                results += bench_physicochem(sequences, repeat, scalar_limit)
+    return {'meta': {'timestamp': time.strftime("%Y-%m-%dT%H:%M:%S"),
+                     'python': platform.python_version(),
+                     'platform': platform.platform(),
+                     'cpu_count': os.cpu_count(),
+                     'scales': list(scales),
+                     'repeat': repeat},
+            'results': results}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark the annotation wrappers with the fake tools.")
+    parser.add_argument("--scales", default=",".join(map(str, DEFAULT_SCALES)),
+                        help="comma-separated numbers of sequences")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--stages", default="parse,subprocess,physicochem")
+    parser.add_argument("--max-subprocess-scale", type=int, default=10000,
+                        help="the largest batch sent through the fake tools")
+    parser.add_argument("--scalar-limit", type=int, default=10000,
+                        help="the largest scale of the per-sequence PhysicoChem methods")
+    parser.add_argument("--output", default="benchmark_results.json")
+    parser.add_argument("--baseline", help="a previous output; exit with 1 if a stage got slower")
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    args = parser.parse_args()
+
+    benchmark = run_benchmarks(
+        scales=[int(scale) for scale in args.scales.split(",")],
+        repeat=args.repeat,
+        stages=args.stages.split(","),
+        max_subprocess_scale=args.max_subprocess_scale,
+        scalar_limit=args.scalar_limit,
+    )
+    with open(args.output, "w") as f:
+        json.dump(benchmark, f, indent=2)
+    print(f"\n>>> benchmark results written to {args.output}.")
+    if args.baseline:
+        regressions = compare(benchmark['results'], args.baseline, args.tolerance)
+        for regression in regressions:
+            print(f"Regression: {regression}", file=sys.stderr)
+        sys.exit(1 if regressions else 0)
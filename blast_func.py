@@ -8,32 +8,145 @@
 # ====================================================
 # Load packages
 # ====================================================
-import tempfile
-import subprocess
-from typing import Dict
+import io
+import asyncio
+from typing import Dict, Iterator, Optional, TextIO, Tuple, Union
+from xml.etree import ElementTree
 
 import Bio
 import operator
+import numpy as np
 from Bio.Blast import NCBIXML as nx
+
+import metrics_func as metrics
+from cache_func import ResultCache, get_cache
+from tool_runner import open_output, run_tool, run_tool_async
+
+# The columns of the tabular (`-outfmt 6`) result, which cover the fields of `BlastRecordObj.toDict`.
+BLAST_TABULAR_FIELDS = (
+    "qseqid", "sseqid", "stitle", "sacc", "slen", "bitscore", "evalue", "score",
+    "length", "nident", "positive", "gaps", "qframe", "sframe",
+    "qstart", "qend", "sstart", "send", "qseq", "sseq",
+)
+BLAST_TABULAR_OUTFMT = "6 " + " ".join(BLAST_TABULAR_FIELDS)
+
+BLASTP_DATABASE_PATH = "./Database/cregion/cregion"
+BLASTP_PARAS = "-outfmt 5 -task blastp-short -num_threads 12"
+TBLASTN_DATABASE_PATH = "./Database/vregion/vregion"
+TBLASTN_PARAS = "-outfmt 5 -num_threads 12 -evalue 1000"
 #===============================================================================
 #===============================================================================
 class Blast:
     """The base class of blast
     """
+    # The started `blast_worker.BlastWorkerPool`s, keyed by (program, database_path, paras).
+    _worker_pools = {}
+    # The `kmer_index.KmerIndex`es tried before blastp, keyed by database_path.
+    _kmer_indexes = {}
+
     def __init__(self, sequence: str):
         self._sequence = sequence
+
+    @staticmethod
+    def register_worker_pool(pool):
+        """Route the `run_blast` calls with the program, database and paras of `pool` to it.
+        """
+        Blast._worker_pools[pool.key] = pool
+
+    @staticmethod
+    def unregister_worker_pool(pool):
+        if Blast._worker_pools.get(pool.key) is pool:
+            del Blast._worker_pools[pool.key]
+
+    @staticmethod
+    def register_kmer_index(database_path: str, kmer_index):
+        """Assign the blastp queries of `database_path` by `kmer_index` first; blastp only runs
+        for the queries the index is not confident about. `kmer_index=None` removes the index.
+        """
+        if kmer_index is None:
+            Blast._kmer_indexes.pop(database_path, None)
+        else:
+            Blast._kmer_indexes[database_path] = kmer_index
+
+    @staticmethod
+    def _prefilter(
+            program: str,
+            sequence: str,
+            database_path: str,
+            query_name: str = "blastp_query_sequence"
+    ) -> Optional[Dict[str, str]]:
+        kmer_index = Blast._kmer_indexes.get(database_path) if program == "blastp" else None
+        if kmer_index is None:
+            return None
+        with metrics.stage(program, "kmer_prefilter"):
+            prefilter_result = kmer_index.query(sequence, query_name=query_name)
+        metrics.add("kmer_prefilter_total", 1, tool=program, assigned=str(prefilter_result is not None))
+        return prefilter_result
     
     def run_blast(self):
         """Waiting to override in the subclass.
         """
         pass
 
+    async def _run_blast_async(
+            self,
+            program: str,
+            database_path: str,
+            paras: str,
+            use_cache: bool,
+            timeout: Optional[float]
+    ) -> Dict[str, str]:
+        """The asyncio counterpart of `run_blast` shared by the subclasses.
+        The query is written to the stdin of blast and the result is read from its stdout.
+        """
+        blast_result = Blast._prefilter(program, self._sequence, database_path)
+        if blast_result is not None:
+            return blast_result
+        cache = get_cache(use_cache)
+        if cache is not None:
+            cache_key = await ResultCache.make_key_async(program, self._sequence, database_path, paras)
+            blast_result = await cache.get_async(cache_key)
+            if blast_result is not None:
+                return blast_result
+        pool = Blast._worker_pools.get((program, database_path, paras))
+        if pool is not None:
+            # A request still queued when the call times out or is cancelled is dropped by the pool.
+            try:
+                blast_result = await asyncio.wait_for(asyncio.wrap_future(pool.submit(self._sequence)), timeout)
+            except asyncio.TimeoutError:
+                raise TimeoutError(f"Error: {program} timed out after {timeout} s.") from None
+        else:
+            blast_cmd = f"{program} -query - -db {database_path} -out - {paras}"
+            blast_run = await run_tool_async(
+                program, blast_cmd.split(" "), timeout, input=f">{program}_query_sequence\n{self._sequence}"
+            )
+            if blast_run.returncode == 0:
+                print(f"\n>>> {program} processed successfully.")
+            else:
+                raise Exception(f"Error: {program} processed failed.")
+            metrics.record_output(program, blast_run.stdout)
+            with metrics.stage(program, "parse"):
+                blast_result = Blast.get_blast_result(io.StringIO(blast_run.stdout))
+        if cache is not None:
+            await cache.set_async(cache_key, blast_result)
+        return blast_result
+
+    @staticmethod
+    def set_num_threads(paras: str, num_threads: int) -> str:
+        """Return `paras` with its `-num_threads` replaced by `num_threads`.
+        """
+        para_list = paras.split(" ")
+        if "-num_threads" in para_list:
+            threads_ind = para_list.index("-num_threads")
+            del para_list[threads_ind:threads_ind + 2]
+        return " ".join(para_list + ["-num_threads", str(num_threads)])
+
     @staticmethod
-    def get_blast_result(blast_result_filename: str):
-        """parse a blast result
+    def get_blast_result(blast_result_filename: Union[str, TextIO]):
+        """parse a blast result, given by its filename or as an open text stream
         """
         blast_record = {}
-        with open(blast_result_filename) as blast_result:
+        with open_output(blast_result_filename) as blast_result:
             for b in nx.parse(blast_result):
                 lobj = BlastRecordObj(b)
                 if not lobj.nohit:
@@ -42,6 +155,180 @@ class Blast:
                     blast_record['nohit'] = True
         return blast_record
 
+    @staticmethod
+    def get_blast_results(blast_result_filename: Union[str, TextIO], lean: bool = False) -> Dict[str, Dict[str, str]]:
+        """parse a blast result holding several queries, one dict per query name.
+        """
+        blast_records = {}
+        for query_name, lobj in Blast.iter_blast_result(blast_result_filename, lean=lean):
+            if not lobj.nohit:
+                blast_records[query_name] = lobj.toDict()
+            else:
+                blast_records[query_name] = {'nohit': True}
+        return blast_records
+
+    @staticmethod
+    def iter_blast_result(
+            blast_result_filename: Union[str, TextIO],
+            lean: bool = False
+    ) -> Iterator[Tuple[str, "BlastRecordObj"]]:
+        """parse a blast result lazily and yield `(query_name, BlastRecordObj)` one query at a time.
+        With `lean=True` the xml is walked by `ElementTree.iterparse` and only the fields of the
+        best hit are kept, so the Bio alignment objects are never built for the other hits.
+        """
+        with open_output(blast_result_filename) as blast_result:
+            if lean:
+                yield from _iter_lean_blast_records(blast_result)
+            else:
+                for b in nx.parse(blast_result):
+                    lobj = BlastRecordObj(b)
+                    yield lobj.query_name, lobj
+
+    @staticmethod
+    def get_blast_tabular_results(blast_result_filename: Union[str, TextIO]) -> Dict[str, Dict[str, str]]:
+        """parse a blast result written with `-outfmt BLAST_TABULAR_OUTFMT`, one dict per query id.
+        The best hit of every query is picked by one vectorized argmax over all the rows, with
+        the same `score * identities_ratio ^ 2` rule (on the first hsp of each hit) as `BlastRecordObj`.
+        The tabular format has no midline, so `match` only keeps the identical residues.
+        """
+        with open_output(blast_result_filename) as blast_result:
+            rows = [line.rstrip("\n").split("\t") for line in blast_result
+                    if line.strip() and not line.startswith("#")]
+        if not rows:
+            return {}
+        columns = dict(zip(BLAST_TABULAR_FIELDS, zip(*rows)))
+        # The first hsp of every (query, subject) pair, as `rec.hsps[0]` in `BlastRecordObj`.
+        pairs = np.array([f"{q}\t{h}" for q, h in zip(columns['qseqid'], columns['sseqid'])])
+        _, pair_first_idx, pair_counts = np.unique(pairs, return_index=True, return_counts=True)
+        pair_order = np.argsort(pair_first_idx)
+        hit_rows = pair_first_idx[pair_order]
+        num_alignments = pair_counts[pair_order]
+        # The query of every hit, numbered by its first appearance.
+        _, query_first_idx, query_inverse = np.unique(
+            np.array(columns['qseqid']), return_index=True, return_inverse=True)
+        query_rank = np.argsort(np.argsort(query_first_idx))
+        hit_query = query_rank[query_inverse[hit_rows]]
+        # Rank the hits of every query at once.
+        score = np.array(columns['score'], dtype=float)[hit_rows]
+        identities_ratio = (np.array(columns['nident'], dtype=float)[hit_rows]
+                            / np.array(columns['length'], dtype=float)[hit_rows])
+        result_score = score * identities_ratio * identities_ratio
+        order = np.lexsort((hit_rows, -result_score, hit_query))
+        is_best = np.ones(len(order), dtype=bool)
+        is_best[1:] = hit_query[order][1:] != hit_query[order][:-1]
+        blast_records = {}
+        for hit_ind in order[is_best]:
+            row = dict(zip(BLAST_TABULAR_FIELDS, rows[hit_rows[hit_ind]]))
+            match = "".join(q if q == h else " " for q, h in zip(row['qseq'], row['sseq']))
+            blast_records[row['qseqid']] = {
+                'nohit': False,
+                'query_name': row['qseqid'],
+                'bits': str(float(row['bitscore'])),
+                'e': str(float(row['evalue'])),
+                'num_alignments': str(int(num_alignments[hit_ind])),
+                'score': str(float(row['score'])),
+                'title': f"{row['sseqid']} {row['stitle']}",
+                'accession': row['sacc'],
+                'hit_def': row['stitle'],
+                'hit_id': row['sseqid'],
+                'length': str(int(row['slen'])),
+                'expect': str(float(row['evalue'])),
+                'identities': str(int(row['nident'])),
+                'positives': str(int(row['positive'])),
+                'gaps': str(int(row['gaps'])),
+                'strand': str(int(row['gaps'])),
+                'frame': str((int(row['qframe']), int(row['sframe']))),
+                'query': row['qseq'],
+                'query_start': str(int(row['qstart'])),
+                'query_end': str(int(row['qend'])),
+                'match': match,
+                'sbjct': row['sseq'],
+                'sbjct_start': str(int(row['sstart'])),
+                'sbjct_end': str(int(row['send'])),
+                'align_length': str(int(row['length'])),
+            }
+        return blast_records
+
+    @staticmethod
+    def _run_blast_batch(
+            program: str,
+            sequences: Dict[str, str],
+            database_path: str,
+            paras: str,
+            tabular: bool = False,
+            use_cache: bool = True
+    ) -> Dict[str, Dict[str, str]]:
+        """Align all the sequences with one blast process.
+        The queries are renamed to `{program}_query_{i}`, `i` counting the distinct sequences, so the
+        sequence ids given by the caller can contain any character.
+        With `tabular=True` the `-outfmt` in `paras` is replaced by `BLAST_TABULAR_OUTFMT`.
+        Repeated sequences are aligned once, and the cached ones or those assigned by the k-mer index
+        are not aligned at all. Every id gets its own copy of the result, named after its query in this batch.
+        """
+        cache = get_cache(use_cache)
+        results = {}
+        cache_keys = {}
+        query_names = {}
+        query_sequences = {}
+        for i, sequence in enumerate(dict.fromkeys(sequences.values())):
+            query_names[sequence] = f"{program}_query_{i}"
+            prefilter_result = Blast._prefilter(program, sequence, database_path, query_names[sequence])
+            if prefilter_result is not None:
+                results[sequence] = prefilter_result
+                continue
+            if cache is not None:
+                cache_keys[sequence] = ResultCache.make_key(program, sequence, database_path, f"{paras} batch tabular={tabular}")
+                cached_result = cache.get(cache_keys[sequence])
+                if cached_result is not None:
+                    results[sequence] = cached_result
+                    continue
+            query_sequences[i] = sequence
+        if query_sequences:
+            blast_records = Blast._run_blast_process(program, query_sequences, database_path, paras, tabular)
+            for i, sequence in query_sequences.items():
+                results[sequence] = blast_records.get(f"{program}_query_{i}", {'nohit': True})
+                if cache is not None:
+                    cache.set(cache_keys[sequence], results[sequence])
+        batch_results = {}
+        for query_id, sequence in sequences.items():
+            batch_result = dict(results[sequence])
+            if not batch_result['nohit']:
+                batch_result['query_name'] = query_names[sequence]  # a cached result keeps the name of its batch
+            batch_results[query_id] = batch_result
+        return batch_results
+
+    @staticmethod
+    def _run_blast_process(
+            program: str,
+            query_sequences: Dict[int, str],
+            database_path: str,
+            paras: str,
+            tabular: bool
+    ) -> Dict[str, Dict[str, str]]:
+        """Run one blast process over the queries `{i: sequence}` named `{program}_query_{i}`, streamed through stdin and stdout.
+        """
+        metrics.add("sequences_total", len(query_sequences), tool=program)
+        with metrics.stage(program, "write_input"):
+            query_fasta = "".join(f">{program}_query_{i}\n{sequence}\n" for i, sequence in query_sequences.items())
+        blast_cmd = f"{program} -query - -db {database_path} -out - {paras}".split(" ")
+        if tabular:
+            if "-outfmt" in blast_cmd:
+                outfmt_ind = blast_cmd.index("-outfmt")
+                del blast_cmd[outfmt_ind:outfmt_ind + 2]
+            blast_cmd += ["-outfmt", BLAST_TABULAR_OUTFMT]
+        blast_run = run_tool(program, blast_cmd, input=query_fasta)
+        if blast_run.returncode == 0:
+            print(f"\n>>> {program} processed {len(query_sequences)} sequences successfully.")
+        else:
+            raise Exception(f"Error: {program} processed failed.")
+        metrics.record_output(program, blast_run.stdout)
+        with metrics.stage(program, "parse"):
+            if tabular:
+                blast_records = Blast.get_blast_tabular_results(io.StringIO(blast_run.stdout))
+            else:
+                blast_records = Blast.get_blast_results(io.StringIO(blast_run.stdout), lean=True)
+        return blast_records
+
 
 class Blastp(Blast):
     """The object was need to be aligned by blastp.
@@ -51,22 +338,67 @@ class Blastp(Blast):
 
     def run_blast(
             self,
-            database_path="./Database/cregion/cregion",
-            paras="-outfmt 5 -task blastp-short -num_threads 12"
+            database_path=BLASTP_DATABASE_PATH,
+            paras=BLASTP_PARAS,
+            use_cache: bool = True
     ) -> Dict[str, str]:
-        with tempfile.NamedTemporaryFile() as input_fasta_file:
-            with open(input_fasta_file.name, 'w') as f:
-                f.write(f">blastp_query_sequence\n{self._sequence}")
-            with tempfile.NamedTemporaryFile(suffix=".xml") as output_file:
-                blastp_cmd = f"blastp -query {input_fasta_file.name} -db {database_path} -out {output_file.name} {paras}"
-                blastp_run = subprocess.run(blastp_cmd.split(" "), capture_output=True, text=True)
-                if blastp_run.returncode == 0:
-                    print("\n>>> blastp processed successfully.")
-                else:
-                    raise Exception(f"Error: blastp processed failed.")
-                blastp_result = Blast.get_blast_result(output_file.name)
+        """Align the sequence by blastp. The sequence is assigned by the k-mer index registered for
+        `database_path` if there is a confident hit, then looked up in the shared cache, unless `use_cache=False`.
+        """
+        blastp_result = Blast._prefilter("blastp", self._sequence, database_path)
+        if blastp_result is not None:
+            return blastp_result
+        cache = get_cache(use_cache)
+        if cache is not None:
+            cache_key = ResultCache.make_key("blastp", self._sequence, database_path, paras)
+            blastp_result = cache.get(cache_key)
+            if blastp_result is not None:
+                return blastp_result
+        pool = Blast._worker_pools.get(("blastp", database_path, paras))
+        if pool is not None:
+            blastp_result = pool.run(self._sequence)
+        else:
+            blastp_cmd = f"blastp -query - -db {database_path} -out - {paras}"
+            blastp_run = run_tool("blastp", blastp_cmd.split(" "), input=f">blastp_query_sequence\n{self._sequence}")
+            if blastp_run.returncode == 0:
+                print("\n>>> blastp processed successfully.")
+            else:
+                raise Exception(f"Error: blastp processed failed.")
+            metrics.record_output("blastp", blastp_run.stdout)
+            with metrics.stage("blastp", "parse"):
+                blastp_result = Blast.get_blast_result(io.StringIO(blastp_run.stdout))
+        if cache is not None:
+            cache.set(cache_key, blastp_result)
         return blastp_result
 
+    @classmethod
+    def run_blast_batch(
+            cls,
+            sequences: Dict[str, str],
+            database_path=BLASTP_DATABASE_PATH,
+            paras=BLASTP_PARAS,
+            tabular: bool = False,
+            use_cache: bool = True
+    ) -> Dict[str, Dict[str, str]]:
+        """Run blastp once for all the sequences (`{sequence_id: sequence}`).
+        The results are returned in the input order, keyed by the sequence id.
+        `tabular=True` asks blastp for the tabular format, which is much faster to parse.
+        """
+        return Blast._run_blast_batch("blastp", sequences, database_path, paras, tabular, use_cache)
+
+    async def run_blast_async(
+            self,
+            database_path=BLASTP_DATABASE_PATH,
+            paras=BLASTP_PARAS,
+            use_cache: bool = True,
+            timeout: Optional[float] = None
+    ) -> Dict[str, str]:
+        """Align the sequence by blastp without blocking the event loop.
+        The number of blastp processes is capped by `tool_runner.set_tool_concurrency("blastp", n)`,
+        and the process is killed after `timeout` seconds or when the call is cancelled.
+        """
+        return await self._run_blast_async("blastp", database_path, paras, use_cache, timeout)
+
 
 class TBlastn(Blast):
     """The object was need to be aligned by tblasn.
@@ -76,31 +408,73 @@ class TBlastn(Blast):
     
     def run_blast(
             self,
-            database_path="./Database/vregion/vregion",
-            paras="-outfmt 5 -num_threads 12 -evalue 1000"
+            database_path=TBLASTN_DATABASE_PATH,
+            paras=TBLASTN_PARAS,
+            use_cache: bool = True
     ) -> Dict[str, str]:
-        with tempfile.NamedTemporaryFile() as input_fasta_file:
-            with open(input_fasta_file.name, 'w') as f:
-                f.write(f">tblastn_query_sequence\n{self._sequence}")
-            with tempfile.NamedTemporaryFile(suffix=".xml") as output_file:
-                tblastn_cmd = f"tblastn -query {input_fasta_file.name} -db {database_path} -out {output_file.name} {paras}"
-                tblastn_run = subprocess.run(tblastn_cmd.split(" "), capture_output=True, text=True)
-                if tblastn_run.returncode == 0:
-                    print("\n>>> tblastn processed successfully.")
-                else:
-                    raise Exception(f"Error: tblastn processed failed.")
-                tblastn_result = Blast.get_blast_result(output_file.name)
+        """Align the sequence by tblastn. The result is looked up in the shared cache first,
+        unless `use_cache=False`.
+        """
+        cache = get_cache(use_cache)
+        if cache is not None:
+            cache_key = ResultCache.make_key("tblastn", self._sequence, database_path, paras)
+            tblastn_result = cache.get(cache_key)
+            if tblastn_result is not None:
+                return tblastn_result
+        pool = Blast._worker_pools.get(("tblastn", database_path, paras))
+        if pool is not None:
+            tblastn_result = pool.run(self._sequence)
+        else:
+            tblastn_cmd = f"tblastn -query - -db {database_path} -out - {paras}"
+            tblastn_run = run_tool("tblastn", tblastn_cmd.split(" "), input=f">tblastn_query_sequence\n{self._sequence}")
+            if tblastn_run.returncode == 0:
+                print("\n>>> tblastn processed successfully.")
+            else:
+                raise Exception(f"Error: tblastn processed failed.")
+            metrics.record_output("tblastn", tblastn_run.stdout)
+            with metrics.stage("tblastn", "parse"):
+                tblastn_result = Blast.get_blast_result(io.StringIO(tblastn_run.stdout))
+        if cache is not None:
+            cache.set(cache_key, tblastn_result)
         return tblastn_result
 
+    @classmethod
+    def run_blast_batch(
+            cls,
+            sequences: Dict[str, str],
+            database_path=TBLASTN_DATABASE_PATH,
+            paras=TBLASTN_PARAS,
+            tabular: bool = False,
+            use_cache: bool = True
+    ) -> Dict[str, Dict[str, str]]:
+        """Run tblastn once for all the sequences (`{sequence_id: sequence}`).
+        The results are returned in the input order, keyed by the sequence id.
+        `tabular=True` asks tblastn for the tabular format, which is much faster to parse.
+        """
+        return Blast._run_blast_batch("tblastn", sequences, database_path, paras, tabular, use_cache)
+
+    async def run_blast_async(
+            self,
+            database_path=TBLASTN_DATABASE_PATH,
+            paras=TBLASTN_PARAS,
+            use_cache: bool = True,
+            timeout: Optional[float] = None
+    ) -> Dict[str, str]:
+        """Align the sequence by tblastn without blocking the event loop.
+        The number of tblastn processes is capped by `tool_runner.set_tool_concurrency("tblastn", n)`,
+        and the process is killed after `timeout` seconds or when the call is cancelled.
+        """
+        return await self._run_blast_async("tblastn", database_path, paras, use_cache, timeout)
+
 
 class BlastRecordObj(object):
     """The object was used to parse records of blast.
     """
     def __init__(self, blast_record):
         if isinstance(blast_record, Bio.Blast.Record.Blast):
+            self.query_name = blast_record.query
             if blast_record.alignments != []:
                 self.nohit = False
-                self.query_name = blast_record.query 
                 score_list = []
                 for ind, rec in enumerate(blast_record.alignments):
                     temp_hsp = rec.hsps[0]
@@ -145,6 +519,19 @@ class BlastRecordObj(object):
                 self.sequence_similarity = float(self.align_length) / float(self.length)  # the ratio of aligned query_seq (include '+', '-' special string) and the length of sbjct_seq (entire length)  e.g. 31 / 106
             else:
                 self.nohit = True
+    @classmethod
+    def from_fields(cls, query_name: str, best_hit: Optional[Dict]) -> "BlastRecordObj":
+        """Build the object from the fields of the best hit (see `_iter_lean_blast_records`).
+        `best_hit=None` means the query has no hit.
+        """
+        lobj = cls.__new__(cls)
+        lobj.query_name = query_name
+        lobj.nohit = best_hit is None
+        if best_hit is not None:
+            lobj.__dict__.update(best_hit)
+            lobj.identities_ratio = float(lobj.identities) / float(lobj.align_length)
+            lobj.sequence_similarity = float(lobj.align_length) / float(lobj.length)
+        return lobj
     #===========================================================================
     #===========================================================================
     def toDict(self):
@@ -175,6 +562,89 @@ class BlastRecordObj(object):
                 'align_length': str(self.align_length),}
 
 
+def _lean_hsp_fields(hsp) -> Dict:
+    """Read the fields of a `<Hsp>` element the same way as `NCBIXML` does.
+    """
+    frame = ()
+    query_frame = hsp.findtext("Hsp_query-frame")
+    if query_frame is not None:
+        frame = (int(query_frame),)
+    hit_frame = hsp.findtext("Hsp_hit-frame")
+    if hit_frame is not None:
+        frame = frame + (int(hit_frame),) if frame else (0, int(hit_frame))
+    if len(frame) == 1:
+        frame += (0,)
+    identities = int(hsp.findtext("Hsp_identity"))
+    positives = hsp.findtext("Hsp_positive")
+    gaps = hsp.findtext("Hsp_gaps")
+    return {'score': float(hsp.findtext("Hsp_score")),
+            'bits': float(hsp.findtext("Hsp_bit-score")),
+            'expect': float(hsp.findtext("Hsp_evalue")),
+            'identities': identities,
+            'positives': int(positives) if positives is not None else identities,
+            'gaps': int(gaps) if gaps is not None else (None, None),
+            'strand': (None, None),
+            'frame': frame,
+            'query': hsp.findtext("Hsp_qseq", ""),
+            'query_start': int(hsp.findtext("Hsp_query-from")),
+            'query_end': int(hsp.findtext("Hsp_query-to")),
+            'match': hsp.findtext("Hsp_midline", ""),
+            'sbjct': hsp.findtext("Hsp_hseq", ""),
+            'sbjct_start': int(hsp.findtext("Hsp_hit-from")),
+            'sbjct_end': int(hsp.findtext("Hsp_hit-to")),
+            'align_length': int(hsp.findtext("Hsp_align-len"))}
+
+
+def _iter_lean_blast_records(blast_result) -> Iterator[Tuple[str, BlastRecordObj]]:
+    """Walk a `-outfmt 5` file and yield `(query_name, BlastRecordObj)` per `<Iteration>`.
+    Each `<Hit>` is ranked by `score * identities_ratio ^ 2` of its first hsp (as in
+    `BlastRecordObj.__init__`) and dropped right after, so memory does not grow with the file.
+    """
+    iterations = None
+    query_name, best_hit, best_score = "", None, None
+    hit_hsp, num_alignments = None, 0
+    for event, elem in ElementTree.iterparse(blast_result, events=("start", "end")):
+        tag = elem.tag
+        if event == "start":
+            if tag == "Hit":
+                hit_hsp, num_alignments = None, 0
+            elif tag == "Hsp":
+                num_alignments += 1
+            elif tag == "Iteration":
+                query_name, best_hit, best_score = "", None, None
+            elif tag == "BlastOutput_iterations":
+                iterations = elem
+            continue
+        if tag == "Hsp":
+            if hit_hsp is None:
+                hit_hsp = _lean_hsp_fields(elem)
+            elem.clear()
+        elif tag == "Hit":
+            if hit_hsp is not None:
+                identities_ratio = float(hit_hsp['identities']) / float(hit_hsp['align_length'])
+                result_score = hit_hsp['score'] * identities_ratio * identities_ratio
+                if best_score is None or result_score > best_score:
+                    hit_id = elem.findtext("Hit_id", "")
+                    hit_def = elem.findtext("Hit_def", "")
+                    best_score = result_score
+                    best_hit = dict(hit_hsp,
+                                    e=hit_hsp['expect'],
+                                    num_alignments=num_alignments,
+                                    title=f"{hit_id} {hit_def}",
+                                    accession=elem.findtext("Hit_accession", ""),
+                                    hit_def=hit_def,
+                                    hit_id=hit_id,
+                                    length=int(elem.findtext("Hit_len")))
+            elem.clear()
+        elif tag == "Iteration_query-def":
+            query_name = elem.text or ""
+        elif tag == "Iteration":
+            yield query_name, BlastRecordObj.from_fields(query_name, best_hit)
+            elem.clear()
+            if iterations is not None:
+                iterations.clear()
+
+
 if __name__ == '__main__':
     # test for partial blast
     a = Blastp("EDQVTQSPEALRLQEGESSSLNCSYTSRMLRGLFWYRQDPGKGPEFLFTLYSAGEEKEKERLKATLTKKESFLHITAPKPEDSATYLCAVQADSWPSYALNFGKGTSLLVTPYIQNPDPAVYQLRDSKSSDKKVCLFTDFDSQTNVSQSKDSDVYITDKCVLDDPSEDFKSNSAVAWSNKPDFACANAFNNSIIPEDTFFPSPESSC").run_blast()
@@ -0,0 +1,186 @@
+# -*- coding: utf-8 -*-
+#===============================================================================
+# Data      : 20261017
+# Author    : Xuanming
+# Annotation: This script is used to keep a blast database warm and serve single-sequence blast requests from worker threads.
+#===============================================================================
+
+# ====================================================
+# Load packages
+# ====================================================
+import os
+import glob
+import mmap
+import queue
+import threading
+import time
+from concurrent.futures import Future, InvalidStateError
+from typing import Dict, List, Optional
+
+from blast_func import BLASTP_DATABASE_PATH, BLASTP_PARAS, Blast
+
+#===============================================================================
+#===============================================================================
+class BlastWorkerPool:
+    """A long-lived pool serving `Blastp.run_blast` / `TBlastn.run_blast` for one database.
+    The database volumes stay memory-mapped and are touched page by page every `rewarm_interval`
+    seconds, so blast finds them in the page cache. The worker threads gather the queued requests
+    into batches of up to `max_batch` (waiting at most `max_wait` seconds) and run one blast process per batch.
+    Once started, the calls of `run_blast` with the same program, database and paras are routed here.
+    """
+
+    def __init__(
+            self,
+            program: str = "blastp",
+            database_path: str = BLASTP_DATABASE_PATH,
+            paras: str = BLASTP_PARAS,
+            workers: int = 2,
+            max_batch: int = 64,
+            max_wait: float = 0.005,
+            rewarm_interval: float = 60.0
+    ):
+        self.program = program
+        self.database_path = database_path
+        self.paras = paras
+        self.workers = workers
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.rewarm_interval = rewarm_interval
+        self._requests = queue.Queue()
+        self._threads: List[threading.Thread] = []
+        self._mmaps: List[mmap.mmap] = []
+        self._stopped = threading.Event()
+
+    @property
+    def key(self):
+        return (self.program, self.database_path, self.paras)
+
+    def start(self) -> "BlastWorkerPool":
+        self._stopped.clear()
+        self._map_database()
+        self._touch_database()
+        self._threads = [
+            threading.Thread(target=self._serve, name=f"{self.program}-worker-{i}", daemon=True)
+            for i in range(self.workers)
+        ]
+        self._threads.append(threading.Thread(target=self._rewarm, name=f"{self.program}-rewarm", daemon=True))
+        for thread in self._threads:
+            thread.start()
+        Blast.register_worker_pool(self)
+        return self
+
+    def stop(self):
+        Blast.unregister_worker_pool(self)
+        self._stopped.set()
+        for _ in range(self.workers):
+            self._requests.put(None)
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+        for database_map in self._mmaps:
+            database_map.close()
+        self._mmaps = []
+
+    def __enter__(self) -> "BlastWorkerPool":
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def submit(self, sequence: str) -> Future:
+        """Queue a sequence and return a `Future` of its `run_blast` result.
+        """
+        if self._stopped.is_set():
+            raise RuntimeError(f"Error: the {self.program} worker pool is stopped.")
+        future = Future()
+        self._requests.put((sequence, future))
+        return future
+
+    def run(self, sequence: str) -> Dict[str, str]:
+        return self.submit(sequence).result()
+
+    def _map_database(self):
+        for filename in sorted(glob.glob(f"{self.database_path}.*")):
+            if os.path.getsize(filename) == 0:
+                continue
+            with open(filename, "rb") as f:
+                database_map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            if hasattr(database_map, "madvise"):
+                database_map.madvise(mmap.MADV_WILLNEED)
+            self._mmaps.append(database_map)
+
+    def _touch_database(self):
+        """Read one byte per page, which brings the volumes back into the page cache.
+        """
+        for database_map in self._mmaps:
+            sum(database_map[offset] for offset in range(0, len(database_map), mmap.PAGESIZE))
+
+    def _rewarm(self):
+        while not self._stopped.wait(self.rewarm_interval):
+            self._touch_database()
+
+    def _next_batch(self) -> List:
+        request = self._requests.get()
+        if request is None:
+            return []
+        batch = [request]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                request = self._requests.get(timeout=timeout)
+            except queue.Empty:
+                break
+            if request is None:  # keep the stop signal for this worker
+                self._requests.put(None)
+                break
+            batch.append(request)
+        return batch
+
+    def _serve(self):
+        while True:
+            batch = self._next_batch()
+            if not batch:
+                return
+            # The requests cancelled while queued (e.g. by an asyncio caller) are dropped; the others
+            # can no longer be cancelled once they are marked running.
+            batch = [(sequence, future) for sequence, future in batch if future.set_running_or_notify_cancel()]
+            if not batch:
+                continue
+            try:
+                blast_results = Blast._run_blast_batch(
+                    self.program,
+                    {i: sequence for i, (sequence, _) in enumerate(batch)},
+                    self.database_path,
+                    self.paras,
+                    use_cache=False
+                )
+            except Exception as error:
+                for _, future in batch:
+                    _resolve(future, exception=error)
+                continue
+            for i, (_, future) in enumerate(batch):
+                blast_result = dict(blast_results[i])
+                if not blast_result['nohit']:
+                    blast_result['query_name'] = f"{self.program}_query_sequence"  # as `run_blast` names it
+                _resolve(future, result=blast_result)
+
+
+def _resolve(future: Future, result=None, exception: Optional[BaseException] = None):
+    """Set the outcome of a request, which never raises in the worker thread.
+    """
+    try:
+        if exception is not None:
+            future.set_exception(exception)
+        else:
+            future.set_result(result)
+    except InvalidStateError:
+        pass
+
+
+if __name__ == '__main__':
+    with BlastWorkerPool("blastp", workers=2) as blastp_pool:
+        from blast_func import Blastp
+        print(Blastp("EDQVTQSPEALRLQEGESSSLNCSYTSRMLRGLFWYRQDPGKGPEFLFTLYSAGEEKEKERLKATLTKKESFLHITAPKPEDSATYLCAVQADSWPSYALNFGKGTSLLVTPYIQNPDPAVYQLRDSKSSDKKVCLFTDFDSQTNVSQSKDSDVYITDKCVLDDPSEDFKSNSAVAWSNKPDFACANAFNNSIIPEDTFFPSPESSC").run_blast())
@@ -0,0 +1,319 @@
+# -*- coding: utf-8 -*-
+#===============================================================================
+# Data      : 20261017
+# Author    : Xuanming
+# Annotation: This script is used to cache the results of the external tools (blast, ANARCI and signalp) on disk.
+#===============================================================================
+
+# ====================================================
+# Load packages
+# ====================================================
+import os
+import glob
+import json
+import time
+import asyncio
+import sqlite3
+import hashlib
+import weakref
+import threading
+import subprocess
+import importlib.util
+import importlib.metadata
+from collections import OrderedDict
+from functools import lru_cache
+from typing import Any, Dict, Optional
+
+#===============================================================================
+#===============================================================================
+DEFAULT_CACHE_PATH = os.path.join(os.path.expanduser("~"), ".cache", "utils_gen", "results.sqlite3")
+# The tools without a `-version` option, versioned by their python package instead.
+PACKAGE_TOOLS = {"ANARCI": "anarci"}
+# The seconds a database fingerprint is reused before the files are stat-ed again.
+FINGERPRINT_TTL = 5.0
+
+# The seconds the size of the cache file is trusted before it is summed again, as other processes store into it too.
+DISK_RECOUNT_INTERVAL = 1.0
+
+# The fingerprint of every database path and the time it was taken.
+_fingerprints = {}
+# Every cache of this process, and the connections inherited from the parent by a forked child.
+_caches = weakref.WeakSet()
+_inherited_connections = []
+
+
+@lru_cache(maxsize=None)
+def tool_version(tool: str) -> str:
+    """Return the first line of `{tool} -version`, or `unknown` if the tool does not report it.
+    The tools of `PACKAGE_TOOLS` are versioned by `package_version`.
+    """
+    if tool in PACKAGE_TOOLS:
+        return package_version(PACKAGE_TOOLS[tool])
+    try:
+        version_run = subprocess.run([tool, "-version"], capture_output=True, text=True, timeout=60)
+    except (OSError, subprocess.TimeoutExpired):
+        return "unknown"
+    if version_run.returncode != 0 or not version_run.stdout.strip():
+        return "unknown"
+    return version_run.stdout.strip().splitlines()[0]
+
+
+def package_version(package: str) -> str:
+    """Return the installed version of a python package and the fingerprint of its HMMs (`{package}/dat/HMMs`,
+    as ANARCI keeps them), or `unknown` if the package is not installed.
+    """
+    try:
+        version = importlib.metadata.version(package)
+    except importlib.metadata.PackageNotFoundError:
+        return "unknown"
+    package_spec = importlib.util.find_spec(package)
+    if package_spec is None or package_spec.origin is None:
+        return f"{package} {version}"
+    hmm_dir = os.path.join(os.path.dirname(package_spec.origin), "dat", "HMMs")
+    hmm_stats = []
+    for filename in sorted(glob.glob(os.path.join(hmm_dir, "*"))):
+        stat = os.stat(filename)
+        hmm_stats.append(f"{os.path.basename(filename)}:{stat.st_size}:{stat.st_mtime_ns}")
+    return f"{package} {version} {';'.join(hmm_stats)}".rstrip()
+
+
+def database_fingerprint(database_path: str) -> str:
+    """Summarize the files of a blast database (`{database_path}.*`) by their size and mtime,
+    so the cache is invalidated when the database is rebuilt. A fingerprint is reused for `FINGERPRINT_TTL` seconds.
+    """
+    if not database_path:
+        return ""
+    now = time.monotonic()
+    fingerprint_time, fingerprint = _fingerprints.get(database_path, (None, None))
+    if fingerprint_time is not None and now - fingerprint_time < FINGERPRINT_TTL:
+        return fingerprint
+    file_stats = []
+    for filename in sorted(glob.glob(f"{database_path}.*")):
+        stat = os.stat(filename)
+        file_stats.append(f"{os.path.basename(filename)}:{stat.st_size}:{stat.st_mtime_ns}")
+    fingerprint = ";".join(file_stats)
+    _fingerprints[database_path] = (now, fingerprint)
+    return fingerprint
+
+
+def result_paras(paras: str) -> str:
+    """`paras` without `-num_threads`, which changes the speed of blast but not its result.
+    """
+    para_list = paras.split(" ")
+    if "-num_threads" in para_list:
+        threads_ind = para_list.index("-num_threads")
+        del para_list[threads_ind:threads_ind + 2]
+    return " ".join(para_list)
+
+
+class ResultCache:
+    """A content-addressed cache of tool results.
+    The results are stored as json in a SQLite file, with an in-memory LRU in front of it.
+    When the file grows over `max_bytes`, the least recently used results are evicted; the access
+    times of the memory hits are written to the file in one go before the next disk lookup or store.
+    Several processes can share the file; a forked child opens its own connection.
+    """
+
+    def __init__(
+            self,
+            cache_path: str = DEFAULT_CACHE_PATH,
+            max_bytes: int = 1 << 30,
+            memory_entries: int = 4096,
+            enabled: bool = True
+    ):
+        self.cache_path = cache_path
+        self.max_bytes = max_bytes
+        self.memory_entries = memory_entries
+        self.enabled = enabled
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self._memory = OrderedDict()
+        self._touched = {}
+        self._lock = threading.Lock()
+        self._connection = None
+        self._disk_bytes = 0
+        self._counted_at = 0.0
+        _caches.add(self)
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._connection is None:
+            os.makedirs(os.path.dirname(os.path.abspath(self.cache_path)), exist_ok=True)
+            self._connection = sqlite3.connect(self.cache_path, timeout=60, check_same_thread=False)
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS results "
+                "(key TEXT PRIMARY KEY, value TEXT NOT NULL, size INTEGER NOT NULL, accessed REAL NOT NULL)"
+            )
+            self._connection.execute("CREATE INDEX IF NOT EXISTS results_accessed ON results (accessed)")
+            self._count_disk_bytes(self._connection)
+        return self._connection
+
+    def _count_disk_bytes(self, connection: sqlite3.Connection):
+        self._disk_bytes = connection.execute("SELECT COALESCE(SUM(size), 0) FROM results").fetchone()[0]
+        self._counted_at = time.monotonic()
+
+    @staticmethod
+    def make_key(tool: str, sequence: str, database_path: str = "", paras: str = "") -> str:
+        """Hash the tool, its version, the database, the parameters (but the thread count) and the sequence into a key.
+        """
+        content = json.dumps(
+            [tool, tool_version(tool), database_path, database_fingerprint(database_path), result_paras(paras), sequence]
+        )
+        return hashlib.sha256(content.encode()).hexdigest()
+
+    @staticmethod
+    async def make_key_async(tool: str, sequence: str, database_path: str = "", paras: str = "") -> str:
+        """`make_key` in the default executor, as the first call for a tool runs `{tool} -version`.
+        """
+        return await asyncio.get_running_loop().run_in_executor(
+            None, ResultCache.make_key, tool, sequence, database_path, paras
+        )
+
+    def get(self, key: str) -> Optional[Any]:
+        """Return the cached result of `key`, or `None` if it is not cached.
+        """
+        if not self.enabled:
+            return None
+        with self._lock:
+            value = self._memory.get(key)
+            if value is not None:
+                self._memory.move_to_end(key)
+                self._touched[key] = time.time()
+                self.memory_hits += 1
+                return json.loads(value)
+            connection = self._connect()
+            self._write_touched(connection)
+            row = connection.execute("SELECT value FROM results WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            connection.execute("UPDATE results SET accessed = ? WHERE key = ?", (time.time(), key))
+            connection.commit()
+            self.disk_hits += 1
+            self._remember(key, row[0])
+            return json.loads(row[0])
+
+    async def get_async(self, key: str) -> Optional[Any]:
+        """`get` in the default executor, so a locked database does not stall the event loop.
+        """
+        return await asyncio.get_running_loop().run_in_executor(None, self.get, key)
+
+    def set(self, key: str, result: Any):
+        """Store the result of `key`, evicting the least recently used results if needed.
+        """
+        if not self.enabled:
+            return
+        value = json.dumps(result)
+        with self._lock:
+            connection = self._connect()
+            self._write_touched(connection)
+            row = connection.execute("SELECT size FROM results WHERE key = ?", (key,)).fetchone()
+            connection.execute(
+                "INSERT OR REPLACE INTO results (key, value, size, accessed) VALUES (?, ?, ?, ?)",
+                (key, value, len(value), time.time())
+            )
+            self._disk_bytes += len(value) - (row[0] if row is not None else 0)
+            if self._disk_bytes > self.max_bytes or time.monotonic() - self._counted_at >= DISK_RECOUNT_INTERVAL:
+                self._count_disk_bytes(connection)
+            if self._disk_bytes > self.max_bytes:
+                self._evict(connection)
+            connection.commit()
+            self._remember(key, value)
+
+    async def set_async(self, key: str, result: Any):
+        """`set` in the default executor, so a locked database does not stall the event loop.
+        """
+        await asyncio.get_running_loop().run_in_executor(None, self.set, key, result)
+
+    def _write_touched(self, connection: sqlite3.Connection):
+        """Update the access times of the results hit in memory since the last disk access.
+        """
+        if self._touched:
+            connection.executemany(
+                "UPDATE results SET accessed = ? WHERE key = ?",
+                [(accessed, key) for key, accessed in self._touched.items()]
+            )
+            connection.commit()
+            self._touched.clear()
+
+    def _remember(self, key: str, value: str):
+        self._memory[key] = value
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_entries:
+            self._memory.popitem(last=False)
+
+    def _evict(self, connection: sqlite3.Connection):
+        """Delete the least recently used results until the cache is back to 90% of `max_bytes`.
+        """
+        target = self.max_bytes * 0.9
+        for key, size in connection.execute("SELECT key, size FROM results ORDER BY accessed").fetchall():
+            if self._disk_bytes <= target:
+                break
+            connection.execute("DELETE FROM results WHERE key = ?", (key,))
+            self._memory.pop(key, None)
+            self._disk_bytes -= size
+
+    def clear(self):
+        with self._lock:
+            self._memory.clear()
+            self._touched.clear()
+            self._connect().execute("DELETE FROM results")
+            self._connection.commit()
+            self._disk_bytes = 0
+
+    def stats(self) -> Dict[str, float]:
+        lookups = self.memory_hits + self.disk_hits + self.misses
+        return {
+            'memory_hits': self.memory_hits,
+            'disk_hits': self.disk_hits,
+            'misses': self.misses,
+            'hit_rate': (self.memory_hits + self.disk_hits) / lookups if lookups else 0.0,
+            'disk_bytes': self._disk_bytes,
+        }
+
+
+def _reset_after_fork():
+    """Give the caches of a forked child a new lock and connection. The inherited connections are
+    kept open but never used, as closing them could disturb the database of the parent.
+    """
+    for cache in list(_caches):
+        if cache._connection is not None:
+            _inherited_connections.append(cache._connection)
+            cache._connection = None
+        cache._lock = threading.Lock()
+        cache._touched.clear()
+
+
+os.register_at_fork(after_in_child=_reset_after_fork)
+
+_default_cache = None
+
+
+def get_default_cache() -> ResultCache:
+    """The cache shared by the tool wrappers.
+    Its location is `$UTILS_GEN_CACHE_PATH` (default `~/.cache/utils_gen/results.sqlite3`),
+    and it is turned off by `UTILS_GEN_CACHE=0`.
+    """
+    global _default_cache
+    if _default_cache is None:
+        _default_cache = ResultCache(
+            cache_path=os.environ.get("UTILS_GEN_CACHE_PATH", DEFAULT_CACHE_PATH),
+            enabled=os.environ.get("UTILS_GEN_CACHE", "1") != "0",
+        )
+    return _default_cache
+
+
+def get_cache(use_cache: bool = True) -> Optional[ResultCache]:
+    """The default cache for a wrapper call, or `None` when the call opts out or the cache is turned off.
+    """
+    cache = get_default_cache()
+    return cache if use_cache and cache.enabled else None
+
+
+if __name__ == '__main__':
+    cache = ResultCache(cache_path="./cache_test.sqlite3")
+    key = ResultCache.make_key("blastp", "EVQLVESGGGLVQPGGSLRLSCAAS", "./Database/cregion/cregion", "-outfmt 5")
+    print(cache.get(key))
+    cache.set(key, {'nohit': True})
+    print(cache.get(key), cache.stats())
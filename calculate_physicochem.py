@@ -5,10 +5,34 @@
 # Annotation: This is for creating the object "PhysicoChem" and calculating molecular_weight, isoelectric_point, and extinction_coefficient.
 # ===============================================================================
 import re
-from typing import Union
+from typing import Dict, List, Sequence, Tuple, Union
 
+import numpy as np
+from Bio.Data.IUPACData import protein_weights
+from Bio.SeqUtils.IsoelectricPoint import negative_pKs, pKcterminal, pKnterminal, positive_pKs
 from Bio.SeqUtils.ProtParam import ProteinAnalysis
 
+import metrics_func as metrics
+
+# The columns of the composition matrix: the 20 amino acids, then pyrrolysine and selenocysteine
+# which only count for the molecular weight (as in `cal_isoelectric_point`, which removes them).
+AMINO_ACIDS = "ACDEFGHIKLMNPQRSTVWY"
+COMPOSITION_COLUMNS = AMINO_ACIDS + "OU"
+WATER_WEIGHT = 18.0153  # average mass, as `Bio.SeqUtils.molecular_weight`
+_IGNORED_CODE = -1  # X and whitespace
+_INVALID_CODE = -2  # B, J, Z and the other letters, for which the molecular weight is undefined
+_CODE_TABLE = np.full(256, _INVALID_CODE, dtype=np.int8)
+_CODE_TABLE[[ord(c) for c in "Xx \t\n\r"]] = _IGNORED_CODE
+for _code, _aa in enumerate(COMPOSITION_COLUMNS):
+    _CODE_TABLE[ord(_aa)] = _CODE_TABLE[ord(_aa.lower())] = _code
+_COLUMN_WEIGHTS = np.array([protein_weights[aa] for aa in COMPOSITION_COLUMNS])
+_CHARGED_COLUMNS = {aa: AMINO_ACIDS.index(aa) for aa in ("K", "R", "H", "D", "E", "C", "Y")}
+# The pK of the termini by the code of the terminal residue (the last entry is for no residue).
+_NTERM_PKS = np.array([pKnterminal.get(aa, positive_pKs["Nterm"]) for aa in AMINO_ACIDS] + [positive_pKs["Nterm"]])
+_CTERM_PKS = np.array([pKcterminal.get(aa, negative_pKs["Cterm"]) for aa in AMINO_ACIDS] + [negative_pKs["Cterm"]])
+_MUTATION_PATTERN = re.compile(r"([A-Za-z])(\d+)([A-Za-z])")  # e.g. S30A
+_MUTATION_SEPARATOR = re.compile(r"[\s,/+;]+")
+
 class PhysicoChem:
 
     def __init__(self):
@@ -16,29 +40,192 @@ class PhysicoChem:
 
     @staticmethod
     def cal_molecular_weight(query_sequence: str) -> float:
-        query_sequence = query_sequence.replace("X", "")
-        molecular_weight = ProteinAnalysis(query_sequence).molecular_weight() / 1000
+        with metrics.stage("PhysicoChem", "molecular_weight"):
+            query_sequence = query_sequence.upper().replace("X", "")
+            molecular_weight = ProteinAnalysis(query_sequence).molecular_weight() / 1000
         return molecular_weight
 
     @staticmethod
     def cal_isoelectric_point(query_sequence: str) -> float:
-        query_sequence = re.sub(r"[BJOUXZ]|\s", "", query_sequence)
-        pI = ProteinAnalysis(query_sequence).isoelectric_point()
+        with metrics.stage("PhysicoChem", "isoelectric_point"):
+            query_sequence = re.sub(r"[BJOUXZ]|\s", "", query_sequence.upper())
+            pI = ProteinAnalysis(query_sequence).isoelectric_point()
         return pI
 
     @staticmethod
     def cal_extinction_coefficient(query_sequence: str, molecular_weight: Union[int, float]) -> float:
-        query_sequence = re.sub(r"[BJOUXZ]", "", query_sequence)
-        amino_acid_c_number = int(query_sequence.count("C") / 2)
-        amino_acid_w_number = query_sequence.count("W")
-        amino_acid_y_number = query_sequence.count("Y")
-        coef = (
+        with metrics.stage("PhysicoChem", "extinction_coefficient"):
+            query_sequence = re.sub(r"[BJOUXZ]", "", query_sequence.upper())
+            amino_acid_c_number = int(query_sequence.count("C") / 2)
+            amino_acid_w_number = query_sequence.count("W")
+            amino_acid_y_number = query_sequence.count("Y")
+            coef = (
+                (
+                    amino_acid_w_number * 5500
+                    + amino_acid_y_number * 1490
+                    + amino_acid_c_number * 125
+                )
+                / molecular_weight
+                / 1000
+            )
+        return coef
+
+    @staticmethod
+    def encode(sequences: List[str]) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+        """Encode the sequences at once into a composition matrix (sequences x `COMPOSITION_COLUMNS` counts).
+        Also return the codes of the N- and C-terminal amino acids (`-1` if there is none) and a mask of
+        the sequences holding letters without a molecular weight.
+        """
+        sequence_number = len(sequences)
+        column_number = len(COMPOSITION_COLUMNS)
+        lengths = np.fromiter((len(sequence) for sequence in sequences), dtype=np.int64, count=sequence_number)
+        codes = _CODE_TABLE[np.frombuffer("".join(sequences).encode("ascii", errors="replace"), dtype=np.uint8)]
+        rows = np.repeat(np.arange(sequence_number), lengths)
+        counted = codes >= 0
+        counts = np.bincount(
+            rows[counted] * column_number + codes[counted], minlength=sequence_number * column_number
+        ).reshape(sequence_number, column_number)
+        invalid = np.bincount(rows[codes == _INVALID_CODE], minlength=sequence_number) > 0
+        # The termini are the first and last of the 20 amino acids, as `cal_isoelectric_point` removes the rest.
+        standard = counted & (codes < len(AMINO_ACIDS))
+        standard_rows, standard_codes = rows[standard], codes[standard]
+        nterm_codes = np.full(sequence_number, -1, dtype=np.int64)
+        cterm_codes = np.full(sequence_number, -1, dtype=np.int64)
+        if standard_rows.size:
+            row_change = standard_rows[1:] != standard_rows[:-1]
+            first = np.concatenate(([True], row_change))
+            last = np.concatenate((row_change, [True]))
+            nterm_codes[standard_rows[first]] = standard_codes[first]
+            cterm_codes[standard_rows[last]] = standard_codes[last]
+        return counts, nterm_codes, cterm_codes, invalid
+
+    @staticmethod
+    def bulk(sequences: List[str]) -> Dict[str, np.ndarray]:
+        """Calculate molecular_weight, isoelectric_point and extinction_coefficient of many sequences at once.
+        The result is columnar (`pandas.DataFrame(result)` turns it into a table) and matches the scalar
+        methods within the tolerance of the pI bisection; both ignore the case of the letters. The molecular weight
+        and the extinction coefficient are `nan` for the sequences holding B, J, Z or other letters, for which
+        `cal_molecular_weight` raises.
+        """
+        metrics.add("sequences_total", len(sequences), tool="PhysicoChem")
+        with metrics.stage("PhysicoChem", "encode"):
+            counts, nterm_codes, cterm_codes, invalid = PhysicoChem.encode(sequences)
+        with metrics.stage("PhysicoChem", "profile"):
+            return PhysicoChem._profile(counts, nterm_codes, cterm_codes, invalid)
+
+    @staticmethod
+    def mutants(parent: str, variants: List[Union[str, Sequence[str]]]) -> Dict[str, np.ndarray]:
+        """Calculate molecular_weight, isoelectric_point and extinction_coefficient of point mutants of `parent`.
+        Each variant is a list of mutations such as `["S30A", "Y102W"]`, or one string such as `S30A/Y102W`
+        (`""` or `WT` is the parent itself); positions are 1-based in `parent`.
+        The composition of the parent is counted once and updated per mutation, and the result is
+        the same as `PhysicoChem.bulk` over the mutated sequences.
+        """
+        parent = parent.upper()
+        parent_counts, parent_nterm, parent_cterm, _ = PhysicoChem.encode([parent])
+        parent_codes = _CODE_TABLE[np.frombuffer(parent.encode("ascii", errors="replace"), dtype=np.uint8)]
+        standard_positions = np.flatnonzero((parent_codes >= 0) & (parent_codes < len(AMINO_ACIDS)))
+        parent_nterm_pos = standard_positions[0] if standard_positions.size else len(parent)
+        parent_cterm_pos = standard_positions[-1] if standard_positions.size else -1
+        parent_invalid_number = int((parent_codes == _INVALID_CODE).sum())
+        variant_number = len(variants)
+        nterm_codes = np.full(variant_number, parent_nterm[0], dtype=np.int64)
+        cterm_codes = np.full(variant_number, parent_cterm[0], dtype=np.int64)
+        invalid = np.zeros(variant_number, dtype=bool)
+        variant_rows, wt_codes, mut_codes = [], [], []
+        for row, variant in enumerate(variants):
+            mutations = _MUTATION_SEPARATOR.split(variant.strip()) if isinstance(variant, str) else variant
+            nterm_pos, cterm_pos = parent_nterm_pos, parent_cterm_pos
+            mutated_positions = set()
+            invalid_number = parent_invalid_number
+            for mutation in mutations:
+                if mutation in ("", "WT"):
+                    continue
+                matched = _MUTATION_PATTERN.fullmatch(mutation)
+                if matched is None:
+                    raise ValueError(f"Error: {mutation!r} is not a mutation like 'S30A'.")
+                wt, pos, mut = matched.group(1).upper(), int(matched.group(2)) - 1, matched.group(3).upper()
+                if not 0 <= pos < len(parent) or parent[pos] != wt:
+                    raise ValueError(f"Error: the residue {pos + 1} of the parent is not {wt} ({mutation}).")
+                if mut not in AMINO_ACIDS:
+                    raise ValueError(f"Error: {mut} of {mutation} is not one of the 20 amino acids.")
+                if pos in mutated_positions:
+                    raise ValueError(f"Error: the residue {pos + 1} is mutated twice in {variant!r}.")
+                mutated_positions.add(pos)
+                variant_rows.append(row)
+                wt_codes.append(parent_codes[pos])
+                mut_codes.append(_CODE_TABLE[ord(mut)])
+                invalid_number -= parent_codes[pos] == _INVALID_CODE
+                if pos <= nterm_pos:
+                    nterm_pos, nterm_codes[row] = pos, mut_codes[-1]
+                if pos >= cterm_pos:
+                    cterm_pos, cterm_codes[row] = pos, mut_codes[-1]
+            invalid[row] = invalid_number > 0
+        counts = np.repeat(parent_counts, variant_number, axis=0)
+        variant_rows = np.array(variant_rows, dtype=np.int64)
+        wt_codes = np.array(wt_codes, dtype=np.int64)
+        counted = wt_codes >= 0
+        np.add.at(counts, (variant_rows[counted], wt_codes[counted]), -1)
+        np.add.at(counts, (variant_rows, np.array(mut_codes, dtype=np.int64)), 1)
+        metrics.add("sequences_total", variant_number, tool="PhysicoChem")
+        with metrics.stage("PhysicoChem", "profile"):
+            return PhysicoChem._profile(counts, nterm_codes, cterm_codes, invalid)
+
+    @staticmethod
+    def _profile(
+            counts: np.ndarray,
+            nterm_codes: np.ndarray,
+            cterm_codes: np.ndarray,
+            invalid: np.ndarray
+    ) -> Dict[str, np.ndarray]:
+        residue_number = counts.sum(axis=1)
+        molecular_weight = (counts @ _COLUMN_WEIGHTS - (residue_number - 1) * WATER_WEIGHT) / 1000
+        molecular_weight[invalid] = np.nan
+        extinction_coefficient = (
             (
-                amino_acid_w_number * 5500
-                + amino_acid_y_number * 1490
-                + amino_acid_c_number * 125
+                counts[:, AMINO_ACIDS.index("W")] * 5500
+                + counts[:, AMINO_ACIDS.index("Y")] * 1490
+                + counts[:, AMINO_ACIDS.index("C")] // 2 * 125
             )
             / molecular_weight
             / 1000
         )
-        return coef
\ No newline at end of file
+        isoelectric_point = PhysicoChem._bulk_isoelectric_point(counts, nterm_codes, cterm_codes)
+        return {
+            'molecular_weight': molecular_weight,
+            'isoelectric_point': isoelectric_point,
+            'extinction_coefficient': extinction_coefficient,
+        }
+
+    @staticmethod
+    def _bulk_isoelectric_point(
+            counts: np.ndarray,
+            nterm_codes: np.ndarray,
+            cterm_codes: np.ndarray
+    ) -> np.ndarray:
+        """The bisection of `Bio.SeqUtils.IsoelectricPoint.pi`, run on all the rows at once.
+        """
+        charged_counts = {aa: counts[:, column].astype(float) for aa, column in _CHARGED_COLUMNS.items()}
+        nterm_pks = _NTERM_PKS[nterm_codes]
+        cterm_pks = _CTERM_PKS[cterm_codes]
+
+        def charge_at_pH(pH: np.ndarray) -> np.ndarray:
+            positive_charge = 1.0 / (10 ** (pH - nterm_pks) + 1.0)
+            for aa in ("K", "R", "H"):
+                positive_charge += charged_counts[aa] / (10 ** (pH - positive_pKs[aa]) + 1.0)
+            negative_charge = 1.0 / (10 ** (cterm_pks - pH) + 1.0)
+            for aa in ("D", "E", "C", "Y"):
+                negative_charge += charged_counts[aa] / (10 ** (negative_pKs[aa] - pH) + 1.0)
+            return positive_charge - negative_charge
+
+        pH = np.full(len(counts), 7.775)
+        min_ = np.full(len(counts), 4.05)
+        max_ = np.full(len(counts), 12.0)
+        while True:
+            active = max_ - min_ > 0.0001
+            if not active.any():
+                return pH
+            positive = charge_at_pH(pH) > 0.0
+            min_ = np.where(active & positive, pH, min_)
+            max_ = np.where(active & ~positive, pH, max_)
+            pH = np.where(active, (min_ + max_) / 2, pH)
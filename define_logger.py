@@ -7,12 +7,139 @@
 # Packages
 # =============================================================================
 import os
+import sys
+import json
+import time
+import atexit
 import logging
+import threading
+import multiprocessing
+import logging.handlers
+
+# ==============================================================================
+# Define the formatter and the handlers for the queued logger
+# ==============================================================================
+class JsonLinesFormatter(logging.Formatter):
+    """Format a record as one json object per line.
+    """
+    def format(self, record):
+        log_record = {
+            "time": self.formatTime(record, self.datefmt),
+            "level": record.levelname,
+            "logger": record.name,
+            "process": record.processName,
+            "message": record.getMessage(),
+        }
+        if record.exc_info:
+            log_record["exc_info"] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            log_record["exc_info"] = record.exc_text
+        return json.dumps(log_record, ensure_ascii=False)
+
+
+class BatchingHandler(logging.handlers.MemoryHandler):
+    """Buffer the records and pass them to `target` when `capacity` records are buffered,
+    `flush_interval` seconds have passed since the last flush, or a record of `flushLevel` comes.
+    """
+    def __init__(self, capacity, target, flush_interval=1.0, flushLevel=logging.ERROR):
+        super().__init__(capacity, flushLevel=flushLevel, target=target, flushOnClose=True)
+        self.flush_interval = flush_interval
+        self._last_flush = time.monotonic()
+
+    def shouldFlush(self, record):
+        return (super().shouldFlush(record)
+                or time.monotonic() - self._last_flush >= self.flush_interval)
+
+    def flush(self):
+        super().flush()
+        self.acquire()
+        try:
+            if self.target is not None:
+                self.target.flush()
+        finally:
+            self.release()
+        self._last_flush = time.monotonic()
+
+    def close(self):
+        target = self.target
+        super().close()
+        if target is not None:
+            target.close()
+
+
+class BatchingQueueListener(logging.handlers.QueueListener):
+    """A `QueueListener` thread that also flushes its batching handlers every `flush_interval`
+    seconds, so the buffered records of a quiet logger still reach the file.
+    """
+    def __init__(self, queue, *handlers, flush_interval=1.0):
+        super().__init__(queue, *handlers, respect_handler_level=True)
+        self.flush_interval = flush_interval
+        self._stopped = threading.Event()
+        self._flush_thread = None
+
+    def start(self):
+        super().start()
+        self._stopped.clear()
+        self._flush_thread = threading.Thread(target=self._flush_periodically, daemon=True)
+        self._flush_thread.start()
+
+    def _flush_periodically(self):
+        while not self._stopped.wait(self.flush_interval):
+            for handler in self.handlers:
+                handler.flush()
+
+    def stop(self, timeout=5.0):
+        """Stop the listener, waiting at most `timeout` seconds for the queued records, and close the handlers.
+        Return False if the listener thread did not finish in time, e.g. because a terminated child left the queue locked.
+        """
+        self._stopped.set()
+        if self._flush_thread is not None:
+            self._flush_thread.join()
+            self._flush_thread = None
+        finished = True
+        if self._thread is not None:
+            self.enqueue_sentinel()
+            self._thread.join(timeout)
+            finished = not self._thread.is_alive()
+            self._thread = None
+        for handler in self.handlers:
+            handler.close()
+        return finished
+
+
+# The listener, the queue and the manager (or None) of every queued logger, by task name.
+_queued_loggers = {}
 
 # ==============================================================================
 # Define the logger for logging
 # ==============================================================================
-def define_logger(log_path, task_name):
+def define_logger(
+        log_path,
+        task_name,
+        queued=False,
+        json_lines=False,
+        max_bytes=0,
+        backup_count=5,
+        when=None,
+        flush_records=100,
+        flush_interval=1.0,
+        mp_context=None,
+        manager_queue=False,
+):
+    """Return the logger `task_name` writing to `{log_path}/{task_name}.log` and the console.
+    With `queued=True` the logger only puts the records into a `multiprocessing.Queue`; a listener
+    thread of this process owns the file and the console and writes the records in batches of
+    `flush_records` (or every `flush_interval` seconds). The child processes log through the same
+    queue: a forked child inherits the logger, and a spawned one calls
+    `define_worker_logger(get_log_queue(task_name), task_name)`; the queue is made by the start method
+    `mp_context` (e.g. `"spawn"`), which has to be the one of the child processes.
+    A child hands its records to a feeder thread, so the records of a child terminated early are lost:
+    call `pool.close(); pool.join()` before leaving `with Pool(...)`, which terminates the workers.
+    With `manager_queue=True` the queue lives in a `Manager` process and a record has reached it
+    when the logging call returns, at the cost of a round trip per record.
+    The file rotates at `max_bytes` bytes (`RotatingFileHandler`) or at `when` (`TimedRotatingFileHandler`,
+    e.g. `"midnight"`), keeping `backup_count` old files, and `json_lines=True` writes one json object per record.
+    """
     logger = logging.getLogger(task_name)  # 使用唯一的日志记录器名称
     if not logger.handlers:  # 避免重复添加处理器
         log_filename = os.path.join(
@@ -23,16 +150,92 @@ def define_logger(log_path, task_name):
         formatter = logging.Formatter(
             "%(asctime)s [%(levelname)s] %(message)s", datefmt="%Y-%m-%d %H:%M:%S"
         )
-        # File handler
-        file_handler = logging.FileHandler(log_filename)
-        file_handler.setFormatter(formatter)
-        logger.addHandler(file_handler)
-        # Stream handler
+        if not queued:
+            # File handler
+            file_handler = logging.FileHandler(log_filename)
+            file_handler.setFormatter(formatter)
+            logger.addHandler(file_handler)
+            # Stream handler
+            stream_handler = logging.StreamHandler()
+            stream_handler.setFormatter(formatter)
+            logger.addHandler(stream_handler)
+            return logger
+        # File handler, owned by the listener
+        if when is not None:
+            file_handler = logging.handlers.TimedRotatingFileHandler(
+                log_filename, when=when, backupCount=backup_count, delay=True
+            )
+        elif max_bytes:
+            file_handler = logging.handlers.RotatingFileHandler(
+                log_filename, maxBytes=max_bytes, backupCount=backup_count, delay=True
+            )
+        else:
+            file_handler = logging.FileHandler(log_filename, delay=True)
+        file_handler.setFormatter(
+            JsonLinesFormatter(datefmt="%Y-%m-%d %H:%M:%S") if json_lines else formatter
+        )
+        # Stream handler, owned by the listener
         stream_handler = logging.StreamHandler()
         stream_handler.setFormatter(formatter)
-        logger.addHandler(stream_handler)
+        if manager_queue:
+            manager = multiprocessing.get_context(mp_context).Manager()
+            log_queue = manager.Queue(-1)
+        else:
+            manager = None
+            log_queue = multiprocessing.get_context(mp_context).Queue(-1)
+        listener = BatchingQueueListener(
+            log_queue,
+            BatchingHandler(flush_records, file_handler, flush_interval),
+            BatchingHandler(flush_records, stream_handler, flush_interval),
+            flush_interval=flush_interval,
+        )
+        listener.start()
+        _queued_loggers[task_name] = (listener, log_queue, manager)
+        logger.addHandler(logging.handlers.QueueHandler(log_queue))
+    return logger
+
+
+def define_worker_logger(log_queue, task_name):
+    """The logger of a child process started with `spawn`, putting its records into `log_queue`.
+    """
+    logger = logging.getLogger(task_name)
+    if not logger.handlers:
+        logger.setLevel(logging.INFO)
+        logger.addHandler(logging.handlers.QueueHandler(log_queue))
     return logger
 
+
+def get_log_queue(task_name):
+    return _queued_loggers[task_name][1]
+
+
+def stop_logger(task_name, timeout=5.0):
+    """Write the buffered records of a queued logger and stop its listener, waiting at most `timeout` seconds.
+    """
+    if task_name not in _queued_loggers:
+        return
+    listener, log_queue, manager = _queued_loggers.pop(task_name)
+    logger = logging.getLogger(task_name)
+    for handler in list(logger.handlers):
+        logger.removeHandler(handler)
+    finished = listener.stop(timeout)
+    if not finished:
+        print(f"Warning: the logger {task_name} did not stop within {timeout} s; its remaining records are dropped.",
+              file=sys.stderr)
+    if manager is not None:
+        manager.shutdown()
+        return
+    if not finished:
+        log_queue.cancel_join_thread()  # never wait on the queue at exit
+    log_queue.close()
+
+
+@atexit.register
+def _stop_loggers():
+    for task_name in list(_queued_loggers):
+        stop_logger(task_name)
+
+
 if __name__ == "__main__":
     log_path = "Results/Table1_Preprocess/cv_results"
     task_name = "test"
@@ -0,0 +1,246 @@
+# -*- coding: utf-8 -*-
+#===============================================================================
+# Data      : 20261017
+# Author    : Xuanming
+# Annotation: This script is used to assign the C region by a k-mer index of the reference sequences before falling back to blastp.
+#===============================================================================
+
+# ====================================================
+# Load packages
+# ====================================================
+import os
+import json
+import math
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+from Bio.Align import substitution_matrices
+
+#===============================================================================
+#===============================================================================
+AMINO_ACIDS = "ACDEFGHIKLMNPQRSTVWY"
+_UNKNOWN_CODE = len(AMINO_ACIDS)  # every other letter, scored as X
+_CODE_TABLE = np.full(256, _UNKNOWN_CODE, dtype=np.int64)
+for _code, _aa in enumerate(AMINO_ACIDS):
+    _CODE_TABLE[ord(_aa)] = _CODE_TABLE[ord(_aa.lower())] = _code
+# The gapped statistics of `-task blastp-short` (PAM30, gap 9/1).
+PAM30_LAMBDA = 0.294
+PAM30_KAPPA = 0.11
+
+
+def _encode(sequence: str) -> np.ndarray:
+    return _CODE_TABLE[np.frombuffer(sequence.encode("ascii", errors="replace"), dtype=np.uint8)]
+
+
+def _kmer_codes(codes: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+    """Return the codes of the k-mers made of the 20 amino acids, and their start positions.
+    """
+    if len(codes) < k:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+    windows = np.lib.stride_tricks.sliding_window_view(codes, k)
+    starts = np.flatnonzero((windows < _UNKNOWN_CODE).all(axis=1))
+    kmers = windows[starts] @ (len(AMINO_ACIDS) ** np.arange(k - 1, -1, -1, dtype=np.int64))
+    return kmers, starts
+
+
+def _read_fasta(fasta_path: str) -> Tuple[List[str], List[str]]:
+    names, sequences = [], []
+    with open(fasta_path) as f:
+        for line in f:
+            line = line.strip()
+            if line.startswith(">"):
+                names.append(line[1:])
+                sequences.append([])
+            elif line:
+                sequences[-1].append(line)
+    return names, ["".join(sequence) for sequence in sequences]
+
+
+class KmerIndex:
+    """A k-mer index over the reference sequences of a blastp database (e.g. `cregion`).
+    `query` assigns a sequence to its reference by the shared k-mers and an ungapped alignment on the
+    best diagonal, and gives up (`None`) when the hit is not confident, so the caller falls back to blastp.
+    The hits are named as `makeblastdb` without `-parse_seqids` names them (`gnl|BL_ORD_ID|{ordinal}`),
+    and the score, bits and e-value use the PAM30 statistics of `-task blastp-short`.
+    """
+
+    def __init__(
+            self,
+            names: List[str],
+            sequences: List[str],
+            k: int,
+            kmers: np.ndarray,
+            postings_ref: np.ndarray,
+            postings_pos: np.ndarray
+    ):
+        self.names = names
+        self.sequences = sequences
+        self.k = k
+        self.kmers = kmers
+        self.postings_ref = postings_ref
+        self.postings_pos = postings_pos
+        self._reference_codes = [_encode(sequence) for sequence in sequences]
+        self._database_length = sum(len(sequence) for sequence in sequences)
+        matrix = substitution_matrices.load("PAM30")
+        alphabet = AMINO_ACIDS + "X"
+        self._matrix = np.array([[matrix[a][b] for b in alphabet] for a in alphabet])
+
+    @classmethod
+    def build(cls, fasta_path: str, k: int = 5) -> "KmerIndex":
+        """Index the reference fasta the blastp database was made from.
+        """
+        names, sequences = _read_fasta(fasta_path)
+        kmers, postings_ref, postings_pos = [], [], []
+        for ref_ind, sequence in enumerate(sequences):
+            ref_kmers, ref_starts = _kmer_codes(_encode(sequence), k)
+            kmers.append(ref_kmers)
+            postings_ref.append(np.full(len(ref_kmers), ref_ind, dtype=np.int32))
+            postings_pos.append(ref_starts.astype(np.int32))
+        kmers = np.concatenate(kmers) if kmers else np.empty(0, dtype=np.int64)
+        order = np.argsort(kmers, kind="stable")
+        return cls(
+            names, sequences, k,
+            kmers[order],
+            np.concatenate(postings_ref)[order] if postings_ref else np.empty(0, dtype=np.int32),
+            np.concatenate(postings_pos)[order] if postings_pos else np.empty(0, dtype=np.int32),
+        )
+
+    def save(self, index_dir: str):
+        os.makedirs(index_dir, exist_ok=True)
+        np.save(os.path.join(index_dir, "kmers.npy"), self.kmers)
+        np.save(os.path.join(index_dir, "postings_ref.npy"), self.postings_ref)
+        np.save(os.path.join(index_dir, "postings_pos.npy"), self.postings_pos)
+        with open(os.path.join(index_dir, "references.json"), "w") as f:
+            json.dump({'k': self.k, 'names': self.names, 'sequences': self.sequences}, f)
+
+    @classmethod
+    def load(cls, index_dir: str, mmap: bool = True) -> "KmerIndex":
+        """Load a saved index; the k-mer arrays are memory-mapped unless `mmap=False`.
+        """
+        mmap_mode = "r" if mmap else None
+        with open(os.path.join(index_dir, "references.json")) as f:
+            references = json.load(f)
+        return cls(
+            references['names'], references['sequences'], references['k'],
+            np.load(os.path.join(index_dir, "kmers.npy"), mmap_mode=mmap_mode),
+            np.load(os.path.join(index_dir, "postings_ref.npy"), mmap_mode=mmap_mode),
+            np.load(os.path.join(index_dir, "postings_pos.npy"), mmap_mode=mmap_mode),
+        )
+
+    def query(
+            self,
+            sequence: str,
+            min_identity: float = 0.95,
+            min_coverage: float = 0.9,
+            candidates: int = 3,
+            query_name: str = "blastp_query_sequence"
+    ) -> Optional[Dict[str, str]]:
+        """Return the best reference of `sequence` in the form of `BlastRecordObj.toDict`, or `None` when
+        the identity or the coverage of the reference is too low, or two references rank the same.
+        The `candidates` references sharing the most k-mers are ranked by `score * identities_ratio ^ 2`,
+        as blast hits are ranked in `BlastRecordObj`. The result is named `query_name`, as blast names the query.
+        """
+        query_codes = _encode(sequence)
+        query_kmers, query_starts = _kmer_codes(query_codes, self.k)
+        lo = np.searchsorted(self.kmers, query_kmers, side="left")
+        hi = np.searchsorted(self.kmers, query_kmers, side="right")
+        hit_numbers = hi - lo
+        if not hit_numbers.sum():
+            return None
+        postings = np.repeat(lo - np.cumsum(hit_numbers) + hit_numbers, hit_numbers) + np.arange(hit_numbers.sum())
+        refs = np.asarray(self.postings_ref[postings], dtype=np.int64)
+        diagonals = np.repeat(query_starts, hit_numbers) - np.asarray(self.postings_pos[postings], dtype=np.int64)
+        # The diagonal sharing the most k-mers for every reference, best references first.
+        (ref_diagonals, shared_numbers) = np.unique(np.stack([refs, diagonals]), axis=1, return_counts=True)
+        order = np.lexsort((-shared_numbers, ref_diagonals[0]))
+        best_of_ref = order[np.concatenate(([True], ref_diagonals[0][order][1:] != ref_diagonals[0][order][:-1]))]
+        best_of_ref = best_of_ref[np.argsort(-shared_numbers[best_of_ref], kind="stable")][:candidates]
+        alignments = [self._align(query_codes, *ref_diagonals[:, ind]) for ind in best_of_ref]
+        alignments.sort(key=lambda alignment: alignment['result_score'], reverse=True)
+        best = alignments[0]
+        if len(alignments) > 1 and alignments[1]['result_score'] == best['result_score']:
+            return None
+        if best['align_length'] == 0 or best['identities'] / best['align_length'] < min_identity:
+            return None
+        if best['align_length'] / len(self.sequences[best['ref']]) < min_coverage:
+            return None
+        return self._to_dict(sequence, best, query_name)
+
+    def _align(self, query_codes: np.ndarray, ref: int, diagonal: int) -> Dict:
+        """Ungapped alignment of the query on a diagonal of a reference, trimmed to the best-scoring segment.
+        """
+        ref_codes = self._reference_codes[ref]
+        query_start = max(0, diagonal)
+        ref_start = query_start - diagonal
+        length = min(len(query_codes) - query_start, len(ref_codes) - ref_start)
+        scores = self._matrix[query_codes[query_start:query_start + length], ref_codes[ref_start:ref_start + length]]
+        # The maximal-scoring segment of the diagonal, as blast's ungapped extension keeps:
+        # the largest rise of the cumulative score.
+        cumulative_scores = np.concatenate(([0], np.cumsum(scores)))
+        rises = cumulative_scores - np.minimum.accumulate(cumulative_scores)
+        best_end = int(np.argmax(rises))
+        best_begin = best_end - int(np.argmin(cumulative_scores[best_end::-1]))
+        best_score = int(rises[best_end])
+        query_segment = query_codes[query_start + best_begin:query_start + best_end]
+        ref_segment = ref_codes[ref_start + best_begin:ref_start + best_end]
+        identities = int(((query_segment == ref_segment) & (query_segment != _UNKNOWN_CODE)).sum())
+        align_length = best_end - best_begin
+        identities_ratio = identities / align_length if align_length else 0.0
+        return {'ref': int(ref),
+                'score': best_score,
+                'result_score': best_score * identities_ratio * identities_ratio,
+                'identities': identities,
+                'positives': int((scores[best_begin:best_end] > 0).sum()),
+                'align_length': align_length,
+                'query_start': query_start + best_begin,
+                'sbjct_start': ref_start + best_begin}
+
+    def _to_dict(self, sequence: str, alignment: Dict, query_name: str) -> Dict[str, str]:
+        sequence = sequence.upper()  # the codes are case-insensitive, the letters of `match` are not
+        ref = alignment['ref']
+        reference = self.sequences[ref]
+        query_start, sbjct_start, align_length = alignment['query_start'], alignment['sbjct_start'], alignment['align_length']
+        query = sequence[query_start:query_start + align_length]
+        sbjct = reference[sbjct_start:sbjct_start + align_length]
+        query_codes, ref_codes = _encode(query), _encode(sbjct)
+        match = "".join(
+            q if q == h else ("+" if self._matrix[qc, hc] > 0 else " ")
+            for q, h, qc, hc in zip(query, sbjct, query_codes.tolist(), ref_codes.tolist())
+        )
+        score = float(alignment['score'])
+        bits = (PAM30_LAMBDA * score - math.log(PAM30_KAPPA)) / math.log(2)
+        expect = PAM30_KAPPA * len(sequence) * self._database_length * math.exp(-PAM30_LAMBDA * score)
+        hit_def = self.names[ref]
+        hit_id = f"gnl|BL_ORD_ID|{ref}"
+        return {'nohit': False,
+                'query_name': query_name,
+                'bits': str(bits),
+                'e': str(expect),
+                'num_alignments': '1',
+                'score': str(score),
+                'title': f"{hit_id} {hit_def}",
+                'accession': str(ref),
+                'hit_def': hit_def,
+                'hit_id': hit_id,
+                'length': str(len(reference)),
+                'expect': str(expect),
+                'identities': str(alignment['identities']),
+                'positives': str(alignment['positives']),
+                'gaps': '0',
+                'strand': '0',
+                'frame': str((0, 0)),
+                'query': query,
+                'query_start': str(query_start + 1),
+                'query_end': str(query_start + align_length),
+                'match': match,
+                'sbjct': sbjct,
+                'sbjct_start': str(sbjct_start + 1),
+                'sbjct_end': str(sbjct_start + align_length),
+                'align_length': str(align_length),}
+
+
+if __name__ == '__main__':
+    cregion_index = KmerIndex.build("./Database/cregion/cregion.fasta")
+    cregion_index.save("./Database/cregion/cregion_kmer_index")
+    cregion_index = KmerIndex.load("./Database/cregion/cregion_kmer_index")
+    print(cregion_index.query("ASTKGPSVFPLAPSSKSTSGGTAALGCLVKDYFPEPVTVSWNSGALTSGVHTFPAVLQSSGLYSLSSVVTVPSSSLGTQTYICNVNHKPSNTKVDKKVEPKSCDKTHTCPPCPAPELLGGPSVFLFPPKPKDTLMISRTPEVTCVVVDVSHEDPEVKFNWYVDGVEVHNAKTKPREEQYNSTYRVVSVLTVLHQDWLNGKEYKCKVSNKALPAPIEKTISKAKGQPREPQVYTLPPSREEMTKNQVSLTCLVKGFYPSDIAVEWESNGQPENNYKTTPPVLDSDGSFFLYSKLTVDKSRWQQGNVFSCSVMHEALHNHYTQKSLSLSPGK"))
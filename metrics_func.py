@@ -0,0 +1,255 @@
+# -*- coding: utf-8 -*-
+#===============================================================================
+# Data      : 20261017
+# Author    : Xuanming
+# Annotation: This script is used to record the timings, the subprocess usage and the cache hit rates of the tool wrappers.
+#===============================================================================
+
+# ====================================================
+# Load packages
+# ====================================================
+import os
+import json
+import math
+import bisect
+import logging
+import resource
+import threading
+import time
+from contextlib import nullcontext
+from typing import Dict, Optional, Tuple
+
+from cache_func import get_default_cache
+
+#===============================================================================
+#===============================================================================
+# The upper bounds (seconds) of the latency histograms.
+LATENCY_BUCKETS = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 10.0, 60.0, 300.0, math.inf)
+METRIC_PREFIX = "utils_gen"
+CACHE_COUNTERS = ("memory_hits", "disk_hits", "misses")
+
+_enabled = os.environ.get("UTILS_GEN_METRICS", "0") == "1"
+_NULL_STAGE = nullcontext()
+
+
+class Histogram:
+    def __init__(self, buckets: Tuple[float, ...] = LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.bucket_counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        self.bucket_counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def quantile(self, q: float) -> float:
+        """The upper bound of the bucket holding the `q` quantile.
+        """
+        rank = q * self.count
+        cumulative = 0
+        for bound, bucket_count in zip(self.buckets, self.bucket_counts):
+            cumulative += bucket_count
+            if cumulative >= rank:
+                return bound
+        return math.inf
+
+
+class MetricsRegistry:
+    """The counters and the latency histograms, keyed by `(name, ((label, value), ...))`.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counters: Dict[Tuple, float] = {}
+        self.histograms: Dict[Tuple, Histogram] = {}
+
+    def add(self, name: str, value: float = 1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name: str, value: float, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            if key not in self.histograms:
+                self.histograms[key] = Histogram()
+            self.histograms[key].observe(value)
+
+    def reset(self):
+        with self._lock:
+            self.counters.clear()
+            self.histograms.clear()
+
+
+registry = MetricsRegistry()
+
+
+class _StageTimer:
+    __slots__ = ("tool", "stage", "start")
+
+    def __init__(self, tool: str, stage: str):
+        self.tool = tool
+        self.stage = stage
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        registry.observe("stage_seconds", time.perf_counter() - self.start, tool=self.tool, stage=self.stage)
+        return False
+
+
+def enable_metrics(enabled: bool = True):
+    """Turn the recording on (or off). It is also turned on by `UTILS_GEN_METRICS=1`.
+    """
+    global _enabled
+    _enabled = enabled
+
+
+def metrics_enabled() -> bool:
+    return _enabled
+
+
+def reset_metrics():
+    registry.reset()
+
+
+def stage(tool: str, name: str):
+    """A context manager timing a stage (e.g. `write_input`, `parse`, `cleanup`) of a tool wrapper;
+    a shared no-op context when the recording is off.
+    """
+    if not _enabled:
+        return _NULL_STAGE
+    return _StageTimer(tool, name)
+
+
+def add(name: str, value: float = 1, **labels):
+    if _enabled:
+        registry.add(name, value, **labels)
+
+
+def record_bytes(tool: str, filename: str):
+    """Count the size of a tool output before it is parsed.
+    """
+    if _enabled and os.path.exists(filename):
+        registry.add("parsed_bytes_total", os.path.getsize(filename), tool=tool)
+
+
+def record_output(tool: str, output: str):
+    """Count the size of a tool output read from its stdout before it is parsed.
+    """
+    if _enabled:
+        registry.add("parsed_bytes_total", len(output), tool=tool)
+
+
+def children_cpu_seconds() -> float:
+    children_usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return children_usage.ru_utime + children_usage.ru_stime
+
+
+def record_subprocess(tool: str, wall_seconds: float, cpu_seconds: float, returncode: int):
+    """Record a finished tool process. The cpu time is the growth of `RUSAGE_CHILDREN` over the run,
+    so it also takes in the other children reaped meanwhile when the tools run concurrently.
+    """
+    registry.observe("stage_seconds", wall_seconds, tool=tool, stage="subprocess")
+    registry.add("subprocess_runs_total", 1, tool=tool, returncode=str(returncode))
+    registry.add("subprocess_wall_seconds_total", wall_seconds, tool=tool)
+    registry.add("subprocess_cpu_seconds_total", max(cpu_seconds, 0.0), tool=tool)
+
+
+def _cache_stats() -> Dict[str, float]:
+    cache = get_default_cache()
+    return cache.stats() if cache.enabled else {}
+
+
+def _format_labels(labels: Tuple) -> str:
+    return ",".join(f'{label}="{value}"' for label, value in labels)
+
+
+def snapshot() -> Dict:
+    """All the metrics as a json-serializable dict.
+    """
+    with registry._lock:
+        counters = [{'name': name, 'labels': dict(labels), 'value': value}
+                    for (name, labels), value in sorted(registry.counters.items())]
+        histograms = [{'name': name,
+                       'labels': dict(labels),
+                       'count': histogram.count,
+                       'sum': histogram.sum,
+                       'p50': histogram.quantile(0.5),
+                       'p95': histogram.quantile(0.95),
+                       'buckets': {str(bound): bucket_count for bound, bucket_count
+                                   in zip(histogram.buckets, histogram.bucket_counts)}}
+                      for (name, labels), histogram in sorted(registry.histograms.items())]
+    return {'counters': counters, 'histograms': histograms, 'cache': _cache_stats()}
+
+
+def dump_json(filename: Optional[str] = None) -> str:
+    metrics_json = json.dumps(snapshot(), indent=2, default=str)
+    if filename is not None:
+        with open(filename, "w") as f:
+            f.write(metrics_json)
+    return metrics_json
+
+
+def dump_prometheus(filename: Optional[str] = None) -> str:
+    """The metrics in the Prometheus text exposition format.
+    """
+    lines = []
+    with registry._lock:
+        for name in sorted({name for name, _ in registry.counters}):
+            lines.append(f"# TYPE {METRIC_PREFIX}_{name} counter")
+            for (counter_name, labels), value in sorted(registry.counters.items()):
+                if counter_name == name:
+                    lines.append(f"{METRIC_PREFIX}_{name}{{{_format_labels(labels)}}} {value}")
+        for name in sorted({name for name, _ in registry.histograms}):
+            lines.append(f"# TYPE {METRIC_PREFIX}_{name} histogram")
+            for (histogram_name, labels), histogram in sorted(registry.histograms.items()):
+                if histogram_name != name:
+                    continue
+                cumulative = 0
+                for bound, bucket_count in zip(histogram.buckets, histogram.bucket_counts):
+                    cumulative += bucket_count
+                    le = "+Inf" if math.isinf(bound) else repr(bound)
+                    lines.append(f"{METRIC_PREFIX}_{name}_bucket{{{_format_labels(labels + (('le', le),))}}} {cumulative}")
+                lines.append(f"{METRIC_PREFIX}_{name}_sum{{{_format_labels(labels)}}} {histogram.sum}")
+                lines.append(f"{METRIC_PREFIX}_{name}_count{{{_format_labels(labels)}}} {histogram.count}")
+    for stat_name, value in _cache_stats().items():
+        # The hits and the misses only grow; the hit rate and the file size go up and down.
+        metric_type = "counter" if stat_name in CACHE_COUNTERS else "gauge"
+        lines.append(f"# TYPE {METRIC_PREFIX}_cache_{stat_name} {metric_type}")
+        lines.append(f"{METRIC_PREFIX}_cache_{stat_name} {value}")
+    prometheus_text = "\n".join(lines) + "\n"
+    if filename is not None:
+        with open(filename, "w") as f:
+            f.write(prometheus_text)
+    return prometheus_text
+
+
+def log_metrics(logger: Optional[logging.Logger] = None, log_path: str = "."):
+    """Write one line per stage and counter to `logger` (default: `define_logger(log_path, "utils_gen_metrics")`).
+    """
+    if logger is None:
+        from define_logger import define_logger
+        logger = define_logger(log_path, "utils_gen_metrics")
+    metrics = snapshot()
+    for histogram in metrics['histograms']:
+        labels = " ".join(f"{label}={value}" for label, value in histogram['labels'].items())
+        logger.info(f"{histogram['name']} {labels}: count={histogram['count']} total={histogram['sum']:.6f} s "
+                    f"mean={histogram['sum'] / histogram['count']:.6f} s p50<={histogram['p50']} s p95<={histogram['p95']} s")
+    for counter in metrics['counters']:
+        labels = " ".join(f"{label}={value}" for label, value in counter['labels'].items())
+        logger.info(f"{counter['name']} {labels}: {counter['value']}")
+    if metrics['cache']:
+        logger.info(f"cache: {metrics['cache']}")
+
+
+if __name__ == '__main__':
+    enable_metrics()
+    with stage("blastp", "parse"):
+        time.sleep(0.01)
+    add("parsed_bytes_total", 1024, tool="blastp")
+    print(dump_prometheus())
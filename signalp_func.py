@@ -5,10 +5,13 @@
 # Author    : Xuanming
 # Annotation: This script is used to detect the signal peptide of the sequence.
 #===============================================================================
+import io
 import os
-from typing import Dict
-import tempfile
-import subprocess
+from typing import Dict, Optional, TextIO, Tuple, Union
+
+import metrics_func as metrics
+from cache_func import ResultCache, get_cache
+from tool_runner import open_output, run_tool, run_tool_async, scratch_directory
 #===============================================================================
 #===============================================================================
 class Signalp:
@@ -16,44 +19,151 @@ class Signalp:
     def __init__(self, sequence: str):
         self._sequence = sequence
     
-    def run_signalp(self) -> Dict[str, str]:
+    def run_signalp(self, use_cache: bool = True) -> Dict[str, str]:
         """run the signalp for searching signal peptide.
+        The fasta and the files of signalp (`-tmp`, `-prefix`) live in a private scratch directory
+        (`tool_runner.get_scratch_dir`), and the prediction is read from stdout (`-stdout`).
+        The result is looked up in the shared cache first, unless `use_cache=False`.
         """
-        with tempfile.TemporaryDirectory() as signalp_tmp_dir:
-            with tempfile.NamedTemporaryFile() as input_fasta_file:
-                with open(input_fasta_file.name, 'w') as f:
-                    f.write(f">signalp_query_sequence\n{self._sequence}")
-                signalp_cmd = f"signalp -fasta {input_fasta_file.name} -tmp {signalp_tmp_dir}"
-                # The application of signalp5 will generate the output file named {input_file_name}_summary.signalp5. Cannot substitute the output with  the temporary file.
-                signalp_run = subprocess.run(signalp_cmd.split(" "), capture_output=True, text=True)
-                if signalp_run.returncode == 0:
-                    signalp_result_filename = os.path.join(os.getcwd(), f"{input_fasta_file.name.split('/')[-1]}_summary.signalp5")
-                    print(f"\n>>> signalp processed successfully.")
-                else:
-                    raise Exception(f"Error: signalp processed failed.")
-        signalp_result = Signalp.get_signalp_result(signalp_result_filename)
+        cache = get_cache(use_cache)
+        if cache is not None:
+            cache_key = ResultCache.make_key("signalp", self._sequence)
+            signalp_result = cache.get(cache_key)
+            if signalp_result is not None:
+                return signalp_result
+        with scratch_directory() as signalp_tmp_dir:
+            signalp_cmd = Signalp._write_query(signalp_tmp_dir, {"signalp_query_sequence": self._sequence})
+            signalp_run = run_tool("signalp", signalp_cmd.split(" "))
+        if signalp_run.returncode == 0:
+            print(f"\n>>> signalp processed successfully.")
+        else:
+            raise Exception(f"Error: signalp processed failed.")
+        metrics.record_output("signalp", signalp_run.stdout)
+        signalp_result = Signalp.get_signalp_result(io.StringIO(signalp_run.stdout))
+        if cache is not None:
+            cache.set(cache_key, signalp_result)
         return signalp_result
-    
+
     @staticmethod
-    def get_signalp_result(signalp_result_filename: str) -> Dict[str, str]:
-        """parse a signalp result
+    def run_signalp_batch(sequences: Dict[str, str], use_cache: bool = True) -> Dict[str, Dict[str, str]]:
+        """run the signalp once for all the sequences (`{sequence_id: sequence}`).
+        The files of signalp go to a private scratch directory and the predictions are read from stdout.
+        The results are returned in the input order, keyed by the sequence id.
+        Repeated or cached sequences are not predicted again.
         """
-        with open(signalp_result_filename, 'r') as f:
-            content = f.readlines()
-        if len(content) > 2:  # a normal result
-            sigp_record = content[2].strip().split('\t')
-            if len(sigp_record) >= 5:
-                sigp_flag = 'Y'  # the quality of signalp result
-                sigp_idx = int(sigp_record[4].split()[2].split('.')[0].split('-')[0])  # extract the end index os signalp region
+        cache = get_cache(use_cache)
+        results = {}
+        cache_keys = {}
+        query_sequences = []
+        for sequence in dict.fromkeys(sequences.values()):
+            if cache is not None:
+                cache_keys[sequence] = ResultCache.make_key("signalp", sequence)
+                cached_result = cache.get(cache_keys[sequence])
+                if cached_result is not None:
+                    results[sequence] = cached_result
+                    continue
+            query_sequences.append(sequence)
+        if query_sequences:
+            metrics.add("sequences_total", len(query_sequences), tool="signalp")
+            with scratch_directory() as signalp_tmp_dir:
+                signalp_cmd = Signalp._write_query(
+                    signalp_tmp_dir, {f"signalp_query_{i}": sequence for i, sequence in enumerate(query_sequences)}
+                )
+                signalp_run = run_tool("signalp", signalp_cmd.split(" "))
+            if signalp_run.returncode == 0:
+                print(f"\n>>> signalp processed {len(query_sequences)} sequences successfully.")
             else:
-                sigp_flag = 'N'
-                sigp_idx = 'None'
+                raise Exception(f"Error: signalp processed failed.")
+            metrics.record_output("signalp", signalp_run.stdout)
+            with metrics.stage("signalp", "parse"):
+                signalp_records = Signalp.get_signalp_results(io.StringIO(signalp_run.stdout))
+            for i, sequence in enumerate(query_sequences):
+                results[sequence] = signalp_records[f"signalp_query_{i}"]
+                if cache is not None:
+                    cache.set(cache_keys[sequence], results[sequence])
+        return {seq_id: results[sequence] for seq_id, sequence in sequences.items()}
+
+    async def run_signalp_async(self, use_cache: bool = True, timeout: Optional[float] = None) -> Dict[str, str]:
+        """run the signalp without blocking the event loop.
+        The number of signalp processes is capped by `tool_runner.set_tool_concurrency("signalp", n)`,
+        and the process is killed after `timeout` seconds or when the call is cancelled.
+        """
+        cache = get_cache(use_cache)
+        if cache is not None:
+            cache_key = await ResultCache.make_key_async("signalp", self._sequence)
+            signalp_result = await cache.get_async(cache_key)
+            if signalp_result is not None:
+                return signalp_result
+        # The scratch directory is removed even if the call times out or is cancelled.
+        with scratch_directory() as signalp_tmp_dir:
+            signalp_cmd = Signalp._write_query(signalp_tmp_dir, {"signalp_query_sequence": self._sequence})
+            signalp_run = await run_tool_async("signalp", signalp_cmd.split(" "), timeout)
+        if signalp_run.returncode == 0:
+            print(f"\n>>> signalp processed successfully.")
+        else:
+            raise Exception(f"Error: signalp processed failed.")
+        metrics.record_output("signalp", signalp_run.stdout)
+        signalp_result = Signalp.get_signalp_result(io.StringIO(signalp_run.stdout))
+        if cache is not None:
+            await cache.set_async(cache_key, signalp_result)
+        return signalp_result
+    
+    @staticmethod
+    def _write_query(signalp_tmp_dir: str, sequences: Dict[str, str]) -> str:
+        """Write the fasta into `signalp_tmp_dir` and return the signalp command, which keeps
+        every file of signalp (`-tmp`, `-prefix`) in that directory and prints the summary to stdout.
+        """
+        input_fasta_filename = os.path.join(signalp_tmp_dir, "signalp_query.fasta")
+        with metrics.stage("signalp", "write_input"), open(input_fasta_filename, 'w') as f:
+            for sequence_id, sequence in sequences.items():
+                f.write(f">{sequence_id}\n{sequence}\n")
+        signalp_prefix = os.path.join(signalp_tmp_dir, "signalp")
+        return f"signalp -fasta {input_fasta_filename} -tmp {signalp_tmp_dir} -prefix {signalp_prefix} -stdout"
+
+    @staticmethod
+    def get_signalp_result(signalp_result_filename: Union[str, TextIO]) -> Dict[str, str]:
+        """parse a signalp result, given as an open text stream or by its filename (the file is removed once parsed)
+        """
+        if isinstance(signalp_result_filename, str):
+            metrics.record_bytes("signalp", signalp_result_filename)
+        with metrics.stage("signalp", "parse"):
+            with open_output(signalp_result_filename) as f:
+                content = [line for line in f if line.strip() and not line.startswith('#')]
+            if content:  # a normal result
+                _, signalp_record = Signalp._parse_signalp_row(content[0])
+        if isinstance(signalp_result_filename, str):
+            with metrics.stage("signalp", "cleanup"):
+                os.remove(signalp_result_filename)
+        return signalp_record
+
+    @staticmethod
+    def get_signalp_results(signalp_result_filename: Union[str, TextIO]) -> Dict[str, Dict[str, str]]:
+        """parse every row of a signalp summary, one dict per sequence id.
+        """
+        signalp_records = {}
+        with open_output(signalp_result_filename) as f:
+            for line in f:
+                if line.strip() and not line.startswith('#'):
+                    sequence_id, signalp_record = Signalp._parse_signalp_row(line)
+                    signalp_records[sequence_id] = signalp_record
+        return signalp_records
+
+    @staticmethod
+    def _parse_signalp_row(line: str) -> Tuple[str, Dict[str, str]]:
+        """parse a row of the signalp summary: `ID  Prediction  SP(Sec/SPI)  OTHER  CS Position`.
+        """
+        sigp_record = line.strip().split('\t')
+        if len(sigp_record) >= 5:
+            sigp_flag = 'Y'  # the quality of signalp result
+            sigp_idx = int(sigp_record[4].split()[2].split('.')[0].split('-')[0])  # extract the end index os signalp region
+        else:
+            sigp_flag = 'N'
+            sigp_idx = 'None'
         signalp_record = {
             'signalp_flag': sigp_flag, 
             'signalp_idx': sigp_idx
         }
-        os.system(f"rm {signalp_result_filename}")
-        return signalp_record
+        return sigp_record[0], signalp_record
 
 # test
 if __name__ == '__main__':
@@ -0,0 +1,131 @@
+# -*- coding: utf-8 -*-
+#===============================================================================
+# Data      : 20261017
+# Author    : Xuanming
+# Annotation: This script is used to run the external tools (blast, ANARCI and signalp) and to keep their scratch files.
+#===============================================================================
+
+# ====================================================
+# Load packages
+# ====================================================
+import os
+import io
+import time
+import asyncio
+import tempfile
+import subprocess
+import weakref
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional, TextIO, Union
+
+import metrics_func as metrics
+
+#===============================================================================
+#===============================================================================
+_tool_concurrency: Dict[str, int] = {}
+_loop_semaphores = weakref.WeakKeyDictionary()
+TMPFS_DIR = "/dev/shm"
+
+
+def get_scratch_dir() -> str:
+    """The directory of the files a tool cannot stream: `$UTILS_GEN_SCRATCH`, else the tmpfs
+    `/dev/shm` when it is writable, else the system temporary directory.
+    """
+    scratch_dir = os.environ.get("UTILS_GEN_SCRATCH")
+    if scratch_dir:
+        os.makedirs(scratch_dir, exist_ok=True)
+        return scratch_dir
+    if os.path.isdir(TMPFS_DIR) and os.access(TMPFS_DIR, os.W_OK):
+        return TMPFS_DIR
+    return tempfile.gettempdir()
+
+
+def scratch_directory() -> tempfile.TemporaryDirectory:
+    """A private directory in the scratch directory, removed in-process when the `with` block ends.
+    """
+    return tempfile.TemporaryDirectory(prefix="utils_gen_", dir=get_scratch_dir())
+
+
+@contextmanager
+def open_output(output: Union[str, TextIO]) -> Iterator[TextIO]:
+    """Open a tool output given by its filename, or pass an open text stream (e.g. `io.StringIO(stdout)`) through.
+    """
+    if isinstance(output, io.IOBase):
+        yield output
+    else:
+        with open(output) as f:
+            yield f
+
+
+def set_tool_concurrency(tool: str, limit: int):
+    """Cap the number of processes of `tool` running at once in an event loop (default: the number of cpus).
+    """
+    _tool_concurrency[tool] = limit
+    for semaphores in _loop_semaphores.values():
+        semaphores.pop(tool, None)
+
+
+def _get_semaphore(tool: str) -> asyncio.Semaphore:
+    semaphores = _loop_semaphores.setdefault(asyncio.get_running_loop(), {})
+    if tool not in semaphores:
+        semaphores[tool] = asyncio.Semaphore(_tool_concurrency.get(tool, os.cpu_count() or 1))
+    return semaphores[tool]
+
+
+def run_tool(tool: str, cmd: List[str], input: Optional[str] = None) -> subprocess.CompletedProcess:
+    """Run `cmd` with `subprocess.run`, writing `input` to its stdin, and recording its wall and
+    cpu time when the metrics are on.
+    """
+    if not metrics.metrics_enabled():
+        return subprocess.run(cmd, input=input, capture_output=True, text=True)
+    start, start_cpu = time.perf_counter(), metrics.children_cpu_seconds()
+    tool_run = subprocess.run(cmd, input=input, capture_output=True, text=True)
+    metrics.record_subprocess(
+        tool, time.perf_counter() - start, metrics.children_cpu_seconds() - start_cpu, tool_run.returncode
+    )
+    return tool_run
+
+
+async def run_tool_async(
+        tool: str,
+        cmd: List[str],
+        timeout: Optional[float] = None,
+        input: Optional[str] = None
+) -> subprocess.CompletedProcess:
+    """Run `cmd` with `asyncio.create_subprocess_exec` under the semaphore of `tool`, writing `input` to its stdin.
+    The process is killed when the call times out (`TimeoutError`) or is cancelled.
+    """
+    record_metrics = metrics.metrics_enabled()
+    async with _get_semaphore(tool):
+        if record_metrics:
+            start, start_cpu = time.perf_counter(), metrics.children_cpu_seconds()
+        tool_process = await asyncio.create_subprocess_exec(
+            *cmd,
+            stdin=asyncio.subprocess.DEVNULL if input is None else asyncio.subprocess.PIPE,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE
+        )
+        try:
+            stdout, stderr = await asyncio.wait_for(
+                tool_process.communicate(None if input is None else input.encode()), timeout
+            )
+        except asyncio.TimeoutError:
+            await _kill(tool_process)
+            raise TimeoutError(f"Error: {tool} timed out after {timeout} s.") from None
+        except BaseException:
+            await _kill(tool_process)
+            raise
+    if record_metrics:
+        metrics.record_subprocess(
+            tool, time.perf_counter() - start, metrics.children_cpu_seconds() - start_cpu, tool_process.returncode
+        )
+    return subprocess.CompletedProcess(cmd, tool_process.returncode, stdout.decode(), stderr.decode())
+
+
+async def _kill(tool_process: asyncio.subprocess.Process):
+    if tool_process.returncode is None:
+        try:
+            tool_process.kill()
+        except ProcessLookupError:
+            pass
+        await asyncio.shield(tool_process.wait())